@@ -2,16 +2,33 @@
 import sqlite3
 import os
 import json
+import hashlib
+import csv
+import io
+import zlib
+import base64
+import re
+import time
+import math
+import uuid
+import threading
+import queue
+import atexit
+import pandas as pd
 from functools import wraps
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime, timedelta, date
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, stream_with_context
 from flask_wtf.csrf import CSRFProtect, generate_csrf
+from markupsafe import Markup, escape
 import bcrypt
 from werkzeug.security import check_password_hash  # For backward compatibility
 from groq import Groq
 from image_matcher import build_image_cache, get_product_image_url
+from inventory_ledger import init_ledger, record_movements, record_qty_overwrites, stock_at
+from order_archive import ARCHIVE_TABLES, FINISHED_STATUSES, init_order_archive
+from invoice_bridge import bridge_orders
 
 # load_dotenv()
 
@@ -26,7 +43,23 @@ groq_client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
 
 # === DATABASE SETUP ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB = os.path.join(BASE_DIR, "database.db")
+DB = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
+
+# Inbox full-text indexes: (fts table, content table, id column, indexed columns)
+INBOX_FTS = (
+    ("feedback_fts", "feedback", "feedback_id", ("username", "email", "message")),
+    ("contact_fts", "contact_submissions", "submission_id", ("name", "email", "subject", "message")),
+)
+
+SQLITE_INT_MAX = 2**63 - 1  # largest integer SQLite can bind
+
+def parse_id_list(value):
+    """Ids from a JSON list, de-duplicated in order, or None unless every element is an int in 1..SQLITE_INT_MAX."""
+    if not isinstance(value, list):
+        return None
+    if not all(type(item) is int and 1 <= item <= SQLITE_INT_MAX for item in value):
+        return None
+    return list(dict.fromkeys(value))
 
 def get_db():
     """Create and return a database connection with dict-like row access."""
@@ -34,6 +67,17 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+def effective_threshold_sql(row):
+    """SQL expression for the reorder threshold of an inventory row alias (item > category > default)."""
+    return f"""
+        (SELECT threshold FROM reorder_thresholds
+         WHERE (scope = 'item' AND scope_key = CAST({row}.inventory_id AS TEXT))
+            OR (scope = 'category' AND scope_key = {row}.category)
+            OR (scope = 'default' AND scope_key = '')
+         ORDER BY CASE scope WHEN 'item' THEN 0 WHEN 'category' THEN 1 ELSE 2 END
+         LIMIT 1)
+    """
+
 def init_db():
     """Initialize database tables if they don't exist."""
     with get_db() as conn:
@@ -78,6 +122,7 @@ def init_db():
         conn.execute("CREATE INDEX IF NOT EXISTS idx_sil_prod    ON sales_invoice_line(product_id)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_prod_name   ON products(hem_name)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_cust_code   ON customers(customer_code)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_part    ON inventory(sup_part_no)")
         # Migrate: add customer_email if not exists (legacy, keeping for backward compatibility)
         try:
             conn.execute("ALTER TABLE transactions ADD COLUMN customer_email TEXT DEFAULT ''")
@@ -88,17 +133,317 @@ def init_db():
             conn.execute("ALTER TABLE transactions ADD COLUMN customer_phone TEXT DEFAULT ''")
         except sqlite3.OperationalError:
             pass
+        # Migrate: server-computed order totals
+        for column in ("subtotal REAL", "shipping_fee REAL DEFAULT 0", "gst_amt REAL DEFAULT 0"):
+            try:
+                conn.execute(f"ALTER TABLE transactions ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        # Migrate: soft-cancelled orders keep their record
+        for column in ("cancelled_at DATETIME", "cancelled_by TEXT"):
+            try:
+                conn.execute(f"ALTER TABLE transactions ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        # Data version counters (bumped by triggers, used for ETags)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('inventory', 0)")
+        # Migrate: per-row version for optimistic concurrency on inventory edits
+        try:
+            conn.execute("ALTER TABLE inventory ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        # Migrate: soft-archive flag (archived items are hidden from the catalog)
+        try:
+            conn.execute("ALTER TABLE inventory ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_inventory_version_{event.lower()}
+                AFTER {event} ON inventory
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = 'inventory';
+                END
+            """)
+        # Inventory movement ledger + snapshots
+        init_ledger(conn)
+        # Stock-take sessions and their captured counts
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_take_sessions (
+                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open','reconciled','cancelled')),
+                created_by TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                reconciled_by TEXT,
+                reconciled_at DATETIME
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_take_counts (
+                session_id INTEGER NOT NULL,
+                inventory_id INTEGER NOT NULL,
+                counted_qty INTEGER NOT NULL,
+                system_qty INTEGER NOT NULL,
+                counted_by TEXT,
+                counted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (session_id, inventory_id),
+                FOREIGN KEY (session_id) REFERENCES stock_take_sessions(session_id)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_loc     ON inventory(loc_on_shelf)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_active_name ON inventory(hem_name, inventory_id) WHERE archived = 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_inv_active_cat  ON inventory(category) WHERE archived = 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_inv ON order_items(inventory_id)")
+        # Orders board: keyset paging per tab, plus prefix-search indexes
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_status_ts ON transactions(status, timestamp, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_username  ON transactions(username COLLATE NOCASE)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_payment   ON transactions(payment_type COLLATE NOCASE)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_phone     ON transactions(customer_phone COLLATE NOCASE)")
+        # Customer order tracking: exact (phone, order id) lookups
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tx_phone_id  ON transactions(customer_phone, id)")
+        # Audit trail of order status moves
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS order_status_transitions (
+                transition_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                from_status TEXT,
+                to_status TEXT NOT NULL,
+                changed_by TEXT,
+                changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ost_order ON order_status_transitions(order_id, transition_id)")
+        init_order_archive(conn)
+        # Idempotency keys: replay stored responses for retried POSTs
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope TEXT NOT NULL,
+                idem_key TEXT NOT NULL,
+                request_hash TEXT NOT NULL,
+                response_json TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL,
+                PRIMARY KEY (scope, idem_key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_idem_expires ON idempotency_keys(expires_at)")
+        # Time-limited stock holds placed when a customer enters checkout
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_holds (
+                hold_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hold_token TEXT NOT NULL,
+                inventory_id INTEGER NOT NULL,
+                qty INTEGER NOT NULL CHECK (qty > 0),
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_holds_item    ON stock_holds(inventory_id, expires_at, hold_token, qty)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_holds_token   ON stock_holds(hold_token)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_holds_expires ON stock_holds(expires_at)")
+        # Low-stock alerts: thresholds per item / category / default, crossings caught by triggers
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS reorder_thresholds (
+                scope TEXT NOT NULL CHECK (scope IN ('item','category','default')),
+                scope_key TEXT NOT NULL DEFAULT '',
+                threshold INTEGER NOT NULL CHECK (threshold >= 0),
+                updated_by TEXT,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, scope_key)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_alerts (
+                alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                inventory_id INTEGER NOT NULL,
+                threshold INTEGER NOT NULL,
+                qty_at_alert INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open','resolved')),
+                opened_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                resolved_at DATETIME
+            )
+        """)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_alert_open ON stock_alerts(inventory_id) WHERE status = 'open'")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_status ON stock_alerts(status, opened_at)")
+        alert_body = f"""
+            INSERT OR IGNORE INTO stock_alerts (inventory_id, threshold, qty_at_alert)
+            SELECT NEW.inventory_id, t.threshold, NEW.qty
+            FROM (SELECT {effective_threshold_sql('NEW')} AS threshold) t
+            WHERE t.threshold IS NOT NULL AND NEW.qty <= t.threshold AND NEW.archived = 0;
+            UPDATE stock_alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP
+            WHERE inventory_id = NEW.inventory_id AND status = 'open'
+              AND NOT COALESCE(NEW.archived = 0 AND NEW.qty <= {effective_threshold_sql('NEW')}, 0);
+        """
+        # Dropped and recreated so changes to the trigger bodies reach existing databases
+        conn.execute("DROP TRIGGER IF EXISTS trg_stock_alert_insert")
+        conn.execute("DROP TRIGGER IF EXISTS trg_stock_alert_update")
+        conn.execute(f"""
+            CREATE TRIGGER trg_stock_alert_insert AFTER INSERT ON inventory
+            BEGIN {alert_body} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER trg_stock_alert_update AFTER UPDATE OF qty, category, archived ON inventory
+            WHEN NEW.qty IS NOT OLD.qty OR NEW.category IS NOT OLD.category OR NEW.archived IS NOT OLD.archived
+            BEGIN {alert_body} END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_stock_alert_delete AFTER DELETE ON inventory
+            BEGIN
+                UPDATE stock_alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP
+                WHERE inventory_id = OLD.inventory_id AND status = 'open';
+            END
+        """)
+        # Staff inboxes: customer feedback and contact form messages
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS feedback (
+                feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                email TEXT,
+                rating INTEGER CHECK(rating >= 1 AND rating <= 5),
+                message TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS contact_submissions (
+                submission_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                phone TEXT,
+                subject TEXT NOT NULL,
+                message TEXT NOT NULL,
+                status TEXT DEFAULT 'new',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_page     ON feedback(created_at, feedback_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating   ON feedback(rating, created_at, feedback_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_page      ON contact_submissions(created_at, submission_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_status_pg ON contact_submissions(status, created_at, submission_id)")
+        # Inbox counters kept by triggers, so the stats cards never scan the inboxes
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS inbox_stats (
+                inbox TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (inbox, bucket)
+            )
+        """)
+        stats_missing = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_feedback_stats_insert'"
+        ).fetchone() is None
+        for name, table, event, body in (
+            ("trg_feedback_stats_insert", "feedback", "INSERT", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('feedback', 'total', 1), ('feedback', 'rating_sum', COALESCE(NEW.rating, 0)),
+                    ('feedback', 'rating:' || COALESCE(NEW.rating, 0), 1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+            ("trg_feedback_stats_delete", "feedback", "DELETE", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('feedback', 'total', -1), ('feedback', 'rating_sum', -COALESCE(OLD.rating, 0)),
+                    ('feedback', 'rating:' || COALESCE(OLD.rating, 0), -1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+            ("trg_feedback_stats_update", "feedback", "UPDATE OF rating", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('feedback', 'rating_sum', COALESCE(NEW.rating, 0) - COALESCE(OLD.rating, 0)),
+                    ('feedback', 'rating:' || COALESCE(OLD.rating, 0), -1),
+                    ('feedback', 'rating:' || COALESCE(NEW.rating, 0), 1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+            ("trg_contact_stats_insert", "contact_submissions", "INSERT", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('contact', 'total', 1), ('contact', 'status:' || COALESCE(NEW.status, 'new'), 1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+            ("trg_contact_stats_delete", "contact_submissions", "DELETE", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('contact', 'total', -1), ('contact', 'status:' || COALESCE(OLD.status, 'new'), -1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+            ("trg_contact_stats_update", "contact_submissions", "UPDATE OF status", """
+                INSERT INTO inbox_stats (inbox, bucket, value) VALUES
+                    ('contact', 'status:' || COALESCE(OLD.status, 'new'), -1),
+                    ('contact', 'status:' || COALESCE(NEW.status, 'new'), 1)
+                ON CONFLICT (inbox, bucket) DO UPDATE SET value = value + excluded.value;"""),
+        ):
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {body} END")
+        if stats_missing:
+            # First run with counters: seed them from the existing rows
+            conn.execute("DELETE FROM inbox_stats")
+            conn.execute("""
+                INSERT INTO inbox_stats (inbox, bucket, value)
+                SELECT 'feedback', 'total', COUNT(*) FROM feedback
+                UNION ALL SELECT 'feedback', 'rating_sum', COALESCE(SUM(rating), 0) FROM feedback
+                UNION ALL SELECT 'feedback', 'rating:' || COALESCE(rating, 0), COUNT(*) FROM feedback GROUP BY 2
+                UNION ALL SELECT 'contact', 'total', COUNT(*) FROM contact_submissions
+                UNION ALL SELECT 'contact', 'status:' || COALESCE(status, 'new'), COUNT(*)
+                          FROM contact_submissions GROUP BY 2
+            """)
+
+        # Full-text indexes over the inboxes (external content, kept in step by triggers)
+        for fts_table, table, id_col, columns in INBOX_FTS:
+            fts_missing = not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+            ).fetchone()
+            conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                    {", ".join(columns)}, content='{table}', content_rowid='{id_col}'
+                )
+            """)
+            new_values = ", ".join(f"NEW.{col}" for col in columns)
+            old_values = ", ".join(f"OLD.{col}" for col in columns)
+            delete_old = f"""INSERT INTO {fts_table} ({fts_table}, rowid, {", ".join(columns)})
+                             VALUES ('delete', OLD.{id_col}, {old_values});"""
+            insert_new = f"""INSERT INTO {fts_table} (rowid, {", ".join(columns)})
+                             VALUES (NEW.{id_col}, {new_values});"""
+            for suffix, event, body in (
+                ("insert", "INSERT", insert_new),
+                ("delete", "DELETE", delete_old),
+                ("update", f"UPDATE OF {', '.join(columns)}", delete_old + insert_new),
+            ):
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_{suffix} AFTER {event} ON {table} "
+                             f"BEGIN {body} END")
+            if fts_missing:
+                conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
         conn.commit()
 
 init_db()
 
+# === HTTP CACHING HELPERS ===
+INVENTORY_CACHE_CONTROL = "private, no-cache"
+IMAGE_LIST_CACHE_CONTROL = "public, no-cache"
+
+def get_data_version(conn, name):
+    """Return the current version counter for a data set (0 if unknown)."""
+    row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row['version'] if row else 0
+
+def not_modified_response(etag, cache_control):
+    """Return a 304 response if the client's If-None-Match matches etag, else None."""
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    return None
+
+def with_validators(response, etag, cache_control):
+    """Attach a strong ETag and Cache-Control header to a response."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 # === BEFORE REQUEST MIDDLEWARE ===
 @app.before_request
 def check_password_change_required():
     """Middleware to enforce password change before accessing any protected route."""
     # Skip for these routes
     exempt_routes = ['staff_login', 'change_password', 'logout', 'static', 'cart', 'checkout', 
-                     'process_payment', 'order_success', 'contact', 'about', 'root']
+                     'process_payment', 'checkout_holds', 'order_success', 'track_order', 'contact', 'about', 'root']
     
     # Check if user must change password
     if session.get('must_change_password') and request.endpoint not in exempt_routes:
@@ -168,18 +513,18 @@ def cart():
     with get_db() as conn:
         # Get total count for KPI
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM inventory")
+        cursor.execute("SELECT COUNT(*) FROM inventory WHERE archived = 0")
         total_inventory_count = cursor.fetchone()[0]
         
-        categories_raw = conn.execute("SELECT DISTINCT category FROM inventory WHERE category IS NOT NULL ORDER BY category").fetchall()
+        categories_raw = conn.execute("SELECT DISTINCT category FROM inventory WHERE archived = 0 AND category IS NOT NULL ORDER BY category").fetchall()
         categories = [row[0] for row in categories_raw]
         
-        origins_raw = conn.execute("SELECT DISTINCT org FROM inventory WHERE org IS NOT NULL AND org != '' ORDER BY org").fetchall()
+        origins_raw = conn.execute("SELECT DISTINCT org FROM inventory WHERE archived = 0 AND org IS NOT NULL AND org != '' ORDER BY org").fetchall()
         origins = [row[0] for row in origins_raw]
         
-        price_range = conn.execute("SELECT MIN(sell_price), MAX(sell_price) FROM inventory WHERE qty > 0").fetchone()
+        price_range = conn.execute("SELECT MIN(sell_price), MAX(sell_price) FROM inventory WHERE qty > 0 AND archived = 0").fetchone()
         
-        where_clause = " WHERE qty > 0"
+        where_clause = " WHERE qty > 0 AND archived = 0"
         params = []
 
         if search_query:
@@ -407,6 +752,197 @@ def checkout():
     """Checkout page where customers finalize their orders."""
     return render_template("checkout.html", role=session.get("role", "customer"), user_cards=[])
 
+# === IDEMPOTENCY HELPERS ===
+IDEMPOTENCY_TTL_HOURS = 24
+IDEMPOTENCY_PURGE_BATCH = 100
+
+def get_idempotency_key():
+    """Read the client's Idempotency-Key header (or body field); returns None if absent."""
+    key = request.headers.get('Idempotency-Key') or (request.get_json(silent=True) or {}).get('idempotency_key')
+    key = (key or '').strip()
+    return key[:255] or None
+
+def request_fingerprint(data):
+    """Stable hash of a JSON request body, used to detect a key reused for a different request."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def replay_idempotent_response(conn, scope, key, fingerprint):
+    """Return the stored response for a live key (or a 422 if the body differs), else None."""
+    row = conn.execute("""
+        SELECT request_hash, response_json FROM idempotency_keys
+        WHERE scope = ? AND idem_key = ? AND expires_at > CURRENT_TIMESTAMP
+    """, (scope, key)).fetchone()
+    if not row:
+        return None
+    if row['request_hash'] != fingerprint:
+        return jsonify({"success": False, "message": "Idempotency key was already used for a different request"}), 422
+    response = jsonify(json.loads(row['response_json']))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def store_idempotent_response(conn, scope, key, fingerprint, body):
+    """Save a response under its key inside the caller's transaction and purge a batch of expired keys."""
+    conn.execute("""
+        DELETE FROM idempotency_keys WHERE rowid IN (
+            SELECT rowid FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP LIMIT ?
+        )
+    """, (IDEMPOTENCY_PURGE_BATCH,))
+    conn.execute("""
+        INSERT OR REPLACE INTO idempotency_keys (scope, idem_key, request_hash, response_json, expires_at)
+        VALUES (?, ?, ?, ?, datetime('now', ?))
+    """, (scope, key, fingerprint, json.dumps(body), f"+{IDEMPOTENCY_TTL_HOURS} hours"))
+
+# === RATE LIMITING ===
+class RateLimiter:
+    """Sliding-window request limiter per client key (in-process)."""
+    def __init__(self, limit, window, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Record a hit for key; returns seconds to wait, or 0 if the hit is allowed."""
+        now = time.monotonic()
+        with self.lock:
+            if len(self.hits) >= self.max_keys:
+                # Forget clients with nothing in the current window
+                self.hits = {k: v for k, v in self.hits.items() if v and v[-1] > now - self.window}
+            hits = self.hits.setdefault(key, deque())
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return max(1, int(hits[0] + self.window - now + 1))
+            hits.append(now)
+            return 0
+
+# === CHECKOUT STOCK HOLDS ===
+HOLD_MINUTES = 15
+HOLD_SWEEP_INTERVAL = 60   # seconds between sweeps
+HOLD_SWEEP_BATCH = 500     # expired holds deleted per statement
+HOLD_MAX_LINE_QTY = 50     # units one checkout may hold of a single item
+HOLD_MAX_UNITS = 200       # units one checkout may hold in total
+HOLD_RATE_LIMIT = 30       # hold requests per client per window
+HOLD_RATE_WINDOW = 60      # seconds
+
+hold_limiter = RateLimiter(HOLD_RATE_LIMIT, HOLD_RATE_WINDOW)
+
+# Active quantity held by OTHER checkouts for inventory row alias `inventory` (param: own hold token)
+HELD_BY_OTHERS_SQL = """(SELECT COALESCE(SUM(h.qty), 0) FROM stock_holds h
+                         WHERE h.inventory_id = inventory.inventory_id
+                           AND h.expires_at > CURRENT_TIMESTAMP AND h.hold_token != ?)"""
+
+def get_hold_token(create=False):
+    """Return the session's checkout hold token, creating one if asked."""
+    token = session.get('hold_token')
+    if not token and create:
+        token = session['hold_token'] = uuid.uuid4().hex
+    return token
+
+def release_expired_holds(conn, batch_size=HOLD_SWEEP_BATCH):
+    """Delete one batch of expired holds; returns how many were removed."""
+    return conn.execute("""
+        DELETE FROM stock_holds WHERE hold_id IN (
+            SELECT hold_id FROM stock_holds WHERE expires_at <= CURRENT_TIMESTAMP LIMIT ?
+        )
+    """, (batch_size,)).rowcount
+
+def hold_sweeper():
+    """Background loop that clears expired holds in small batches (they are already ignored once expired)."""
+    while True:
+        time.sleep(HOLD_SWEEP_INTERVAL)
+        try:
+            conn = get_db()
+            try:
+                while release_expired_holds(conn) == HOLD_SWEEP_BATCH:
+                    conn.commit()
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error sweeping stock holds: {e}")
+
+threading.Thread(target=hold_sweeper, name="hold-sweeper", daemon=True).start()
+
+@app.route("/api/checkout/holds", methods=["POST", "DELETE"])
+@csrf.exempt
+def checkout_holds():
+    """API: Hold the cart's stock for HOLD_MINUTES when entering checkout (POST), or release it (DELETE)."""
+    if request.method == "DELETE":
+        token = get_hold_token()
+        if token:
+            with get_db() as conn:
+                conn.execute("DELETE FROM stock_holds WHERE hold_token = ?", (token,))
+                conn.commit()
+        return jsonify({"success": True, "message": "Holds released"})
+
+    retry_after = hold_limiter.allow(request.remote_addr or "unknown")
+    if retry_after:
+        response = jsonify({"success": False, "message": "Too many requests, please try again shortly"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+
+    data = request.get_json(silent=True) or {}
+    try:
+        _, requested = parse_cart(data.get('cart') or [])
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if any(qty > HOLD_MAX_LINE_QTY for qty in requested.values()) or sum(requested.values()) > HOLD_MAX_UNITS:
+        return jsonify({
+            "success": False,
+            "message": f"Online checkout is limited to {HOLD_MAX_LINE_QTY} of an item and "
+                       f"{HOLD_MAX_UNITS} items in total; please contact us for larger orders"
+        }), 400
+    token = get_hold_token(create=True)
+
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Replace this checkout's previous holds with the current cart
+            conn.execute("DELETE FROM stock_holds WHERE hold_token = ?", (token,))
+            shortages = []
+            holds = []
+            if requested:
+                placeholders = ",".join("?" * len(requested))
+                available = {
+                    row['inventory_id']: row for row in conn.execute(f"""
+                        SELECT inventory_id, hem_name, qty - {HELD_BY_OTHERS_SQL} AS available
+                        FROM inventory
+                        WHERE inventory_id IN ({placeholders}) AND archived = 0
+                    """, [token] + list(requested))
+                }
+                for inventory_id, qty in requested.items():
+                    row = available.get(inventory_id)
+                    if row and row['available'] >= qty:
+                        holds.append((token, inventory_id, qty, f"+{HOLD_MINUTES} minutes"))
+                    else:
+                        shortages.append({
+                            "id": inventory_id,
+                            "name": row['hem_name'] if row else None,
+                            "requested": qty,
+                            "available": max(row['available'], 0) if row else 0
+                        })
+                conn.executemany("""
+                    INSERT INTO stock_holds (hold_token, inventory_id, qty, expires_at)
+                    VALUES (?, ?, ?, datetime('now', ?))
+                """, holds)
+            expires_at = conn.execute(
+                "SELECT datetime('now', ?)", (f"+{HOLD_MINUTES} minutes",)
+            ).fetchone()[0]
+            conn.commit()
+
+        return jsonify({
+            "success": not shortages,
+            "message": "Stock held for checkout" if not shortages
+                       else "Some items no longer have enough stock",
+            "expires_at": expires_at,
+            "held_items": len(holds),
+            "shortages": shortages
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route("/process-payment", methods=["POST"])
 @csrf.exempt
 def process_payment():
@@ -417,90 +953,177 @@ def process_payment():
 
     cart_items = data.get('cart', [])
     payment_method = data.get('payment_method', 'Credit Card')
-    total_amount = data.get('total_amount', 0)
     fulfillment_method = data.get('fulfillment_method', 'pickup')
     fulfillment_details = data.get('fulfillment_details', '')
     customer_phone = data.get('customer_phone', '')
     username = session.get("username", "Guest")
+    idempotency_key = get_idempotency_key()
+    fingerprint = request_fingerprint({k: v for k, v in data.items() if k != 'idempotency_key'})
 
     if not cart_items:
         return jsonify({"success": False, "message": "Cart is empty"})
 
+    try:
+        lines, requested = parse_cart(cart_items)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+    accept_reprice = bool(data.get('accept_reprice'))
+    hold_token = get_hold_token() or ''
+
     try:
         with get_db() as conn:
-            # First, validate that all items have sufficient inventory
-            for item in cart_items:
-                inventory_id = item.get('id')
-                requested_qty = item.get('quantity', 1)
-                product_name = item.get('name', 'Unknown Product')
-                
-                # Check current inventory
-                inventory_row = conn.execute(
-                    "SELECT qty, hem_name FROM inventory WHERE inventory_id = ?",
-                    (inventory_id,)
-                ).fetchone()
-                
-                if not inventory_row:
+            # Take the write lock up front so validation and decrement are one atomic step
+            conn.execute("BEGIN IMMEDIATE")
+
+            # A retried request (even a concurrent duplicate, which waits on the lock) gets the original result
+            if idempotency_key:
+                replay = replay_idempotent_response(conn, 'process-payment', idempotency_key, fingerprint)
+                if replay:
+                    conn.rollback()
+                    return replay
+
+            # One lookup for every line's authoritative price, name, SKU, image and stock
+            # (stock held by other customers' checkouts is not available to this one)
+            placeholders = ",".join("?" * len(requested))
+            products = {
+                row['inventory_id']: row for row in conn.execute(f"""
+                    SELECT inventory_id, hem_name, sup_part_no, sell_price, image_url,
+                           qty - {HELD_BY_OTHERS_SQL} AS qty
+                    FROM inventory
+                    WHERE inventory_id IN ({placeholders}) AND archived = 0
+                """, [hold_token] + list(requested))
+            }
+
+            repriced = []
+            for inventory_id, quantity, item in lines:
+                product = products.get(inventory_id)
+                if not product:
+                    conn.rollback()
                     return jsonify({
-                        "success": False, 
-                        "message": f"Product '{product_name}' not found in inventory"
+                        "success": False,
+                        "message": f"Product '{item.get('name', 'Unknown Product')}' not found in inventory"
                     })
-                
-                current_qty = inventory_row['qty']
-                
-                if current_qty < requested_qty:
+                if product['qty'] < requested[inventory_id]:
+                    conn.rollback()
                     return jsonify({
-                        "success": False, 
-                        "message": f"Insufficient stock for '{product_name}'. Only {current_qty} available, but {requested_qty} requested."
+                        "success": False,
+                        "message": f"Insufficient stock for '{product['hem_name']}'. "
+                                   f"Only {product['qty']} available, but {requested[inventory_id]} requested."
                     })
+                client_price = item.get('price')
+                if not isinstance(client_price, (int, float)) or abs(client_price - product['sell_price']) > 0.005:
+                    repriced.append({"id": inventory_id, "name": product['hem_name'],
+                                     "old_price": client_price, "price": product['sell_price']})
+
+            if repriced and not accept_reprice:
+                conn.rollback()
+                return jsonify({
+                    "success": False,
+                    "price_changed": True,
+                    "message": "Some prices have changed. Please review your cart and confirm again.",
+                    "repriced": repriced
+                }), 409
+
+            # Conditional decrement: guards the stock check above at the row level
+            reserved = conn.executemany(
+                f"""UPDATE inventory 
+                   SET qty = qty - ?, row_version = row_version + 1 
+                   WHERE inventory_id = ? AND archived = 0
+                     AND qty - {HELD_BY_OTHERS_SQL} >= ?""",
+                [(qty, inventory_id, hold_token, qty) for inventory_id, qty in requested.items()]
+            ).rowcount
+            if reserved != len(requested):
+                conn.rollback()
+                return jsonify({"success": False, "message": "Stock changed during checkout. Please try again."})
+
+            totals = order_totals(
+                sum(products[inventory_id]['sell_price'] * quantity for inventory_id, quantity, _ in lines),
+                fulfillment_method
+            )
             
-            # All items validated - proceed with order creation
             # Insert into transactions table with fulfillment info
             cursor = conn.execute(
                 """INSERT INTO transactions 
-                   (username, payment_type, amount, status, fulfillment_method, fulfillment_details, customer_phone) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (username, payment_method, total_amount, 'Incoming', fulfillment_method, fulfillment_details, customer_phone)
+                   (username, payment_type, amount, subtotal, shipping_fee, gst_amt, status,
+                    fulfillment_method, fulfillment_details, customer_phone) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (username, payment_method, totals['total'], totals['subtotal'], totals['shipping_fee'],
+                 totals['gst_amt'], 'Incoming', fulfillment_method, fulfillment_details, customer_phone)
             )
             order_id = cursor.lastrowid
             
-            # Insert each cart item into order_items table AND deduct from inventory
-            for item in cart_items:
-                inventory_id = item.get('id')
-                product_name = item.get('name', 'Unknown Product')
-                product_sku = item.get('sku', '')
-                quantity = item.get('quantity', 1)
-                unit_price = item.get('price', 0)
-                image_url = item.get('image', '/static/product_images_v2/placeholder.png')
-                
-                # Insert order item
-                conn.execute(
-                    """INSERT INTO order_items 
-                       (order_id, inventory_id, product_name, product_sku, quantity, unit_price, image_url)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (order_id, inventory_id, product_name, product_sku, quantity, unit_price, image_url)
-                )
-                
-                # Deduct from inventory
-                conn.execute(
-                    """UPDATE inventory 
-                       SET qty = qty - ? 
-                       WHERE inventory_id = ?""",
-                    (quantity, inventory_id)
-                )
+            conn.executemany(
+                """INSERT INTO order_items 
+                   (order_id, inventory_id, product_name, product_sku, quantity, unit_price, image_url)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(order_id, inventory_id, products[inventory_id]['hem_name'], products[inventory_id]['sup_part_no'],
+                  quantity, products[inventory_id]['sell_price'],
+                  products[inventory_id]['image_url'] or item.get('image', '/static/product_images_v2/placeholder.png'))
+                 for inventory_id, quantity, item in lines]
+            )
             
+            record_movements(
+                conn,
+                [(inventory_id, 'sale', -qty, f"order:{order_id}") for inventory_id, qty in requested.items()],
+                created_by=username
+            )
+            # This checkout's holds have become a sale
+            conn.execute("DELETE FROM stock_holds WHERE hold_token = ?", (hold_token,))
+            result = {
+                "success": True, 
+                "message": "Payment successful",
+                "order_id": order_id,
+                "totals": totals
+            }
+            if idempotency_key:
+                store_idempotent_response(conn, 'process-payment', idempotency_key, fingerprint, result)
             conn.commit()
         
-        return jsonify({
-            "success": True, 
-            "message": "Payment successful",
-            "order_id": order_id
-        })
+        order_event_bus.publish(
+            "order_created", order_id=order_id, status="Incoming", amount=totals['total'],
+            username=username, fulfillment_method=fulfillment_method
+        )
+        return jsonify(result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"success": False, "message": str(e)})
 
+def parse_cart(cart_items):
+    """Validate cart lines; returns (lines, requested qty per inventory_id). Raises ValueError."""
+    lines = []
+    requested = {}
+    for item in cart_items:
+        try:
+            inventory_id = int(item.get('id'))
+            quantity = int(item.get('quantity', 1))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("Invalid cart item")
+        if quantity < 1:
+            raise ValueError("Quantities must be at least 1")
+        lines.append((inventory_id, quantity, item))
+        # A product can appear on several lines
+        requested[inventory_id] = requested.get(inventory_id, 0) + quantity
+    return lines, requested
+
+GST_RATE = 0.09  # Singapore GST; shelf prices are GST-inclusive
+
+def order_totals(subtotal, fulfillment_method):
+    """Server-side order totals using the same shipping tiers as the checkout page."""
+    shipping_fee = 0.0
+    if fulfillment_method == 'delivery':
+        if subtotal < 100:
+            shipping_fee = 3.50
+        elif subtotal < 888:
+            shipping_fee = 1.50
+    total = round(subtotal + shipping_fee, 2)
+    return {
+        "subtotal": round(subtotal, 2),
+        "shipping_fee": shipping_fee,
+        "total": total,
+        "gst_amt": round(total * GST_RATE / (1 + GST_RATE), 2)
+    }
+
 @app.route("/order-success")
 def order_success():
     """Order confirmation page after successful payment."""
@@ -508,12 +1131,159 @@ def order_success():
     date = request.args.get('date', '')
     return render_template("order_success.html", method=method, date=date, role="customer")
 
+# === ORDER TRACKING ===
+TRACKING_RATE_LIMIT = 10     # lookups per client per window
+TRACKING_RATE_WINDOW = 60    # seconds
+TRACKING_CACHE_TTL = 30      # seconds a lookup result is reused
+TRACKING_CACHE_SIZE = 2000
+
+tracking_limiter = RateLimiter(TRACKING_RATE_LIMIT, TRACKING_RATE_WINDOW)
+tracking_cache = {}  # (order_id, phone) -> (expires_at, payload)
+tracking_cache_lock = threading.Lock()
+
+def lookup_tracked_order(conn, order_id, phone):
+    """Status and items of an order if the phone matches; checks archived orders too."""
+    for orders_table, items_table in (("transactions", "order_items"),
+                                      (ARCHIVE_TABLES["transactions"], ARCHIVE_TABLES["order_items"])):
+        order = conn.execute(f"""
+            SELECT id, status, fulfillment_method, amount, timestamp
+            FROM {orders_table}
+            WHERE customer_phone = ? AND id = ?
+        """, (phone, order_id)).fetchone()
+        if order:
+            items = conn.execute(f"""
+                SELECT product_name, product_sku, quantity, unit_price, image_url
+                FROM {items_table} WHERE order_id = ? ORDER BY item_id
+            """, (order_id,)).fetchall()
+            return dict(order, items=[dict(item) for item in items])
+    return None
+
+@app.route("/api/track-order")
+def track_order():
+    """API: Public order status lookup by order id + the phone number used at checkout."""
+    retry_after = tracking_limiter.allow(request.remote_addr or "unknown")
+    if retry_after:
+        response = jsonify({"success": False, "message": "Too many lookups, please try again shortly"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+
+    order_id = request.args.get("order_id", "").lstrip("#").strip()
+    phone = request.args.get("phone", "").strip()
+    if not (order_id.isascii() and order_id.isdigit()) or int(order_id) > SQLITE_INT_MAX or not phone:
+        return jsonify({"success": False, "message": "Order number and phone number are required"}), 400
+    key = (int(order_id), phone)
+
+    now = time.monotonic()
+    with tracking_cache_lock:
+        cached = tracking_cache.get(key)
+    if cached and cached[0] > now:
+        payload = cached[1]
+    else:
+        with get_db() as conn:
+            order = lookup_tracked_order(conn, key[0], phone)
+        # Same message for unknown orders and wrong phones, so ids can't be probed
+        payload = ({"success": True, "order": order} if order
+                   else {"success": False, "message": "No order found for that order number and phone"})
+        with tracking_cache_lock:
+            if len(tracking_cache) >= TRACKING_CACHE_SIZE:
+                tracking_cache.clear()
+            tracking_cache[key] = (now + TRACKING_CACHE_TTL, payload)
+
+    response = jsonify(payload)
+    response.headers["Cache-Control"] = f"private, max-age={TRACKING_CACHE_TTL}"
+    return response, 200 if payload["success"] else 404
+
+# === PUBLIC SUBMISSIONS ===
+SUBMISSION_QUEUE_SIZE = 1000      # pending contact/feedback submissions held in memory
+SUBMISSION_FLUSH_BATCH = 200      # rows per write transaction
+SUBMISSION_FLUSH_INTERVAL = 2     # seconds the writer gathers a batch before flushing
+SUBMISSION_RATE_LIMIT = 5         # submissions per client per window
+SUBMISSION_RATE_WINDOW = 600      # seconds
+# Queued submissions are lost if the process dies before a flush; set to write each one before replying
+SUBMISSION_SYNC_WRITES = os.getenv("SUBMISSION_SYNC_WRITES", "0") == "1"
+
+SUBMISSION_INSERTS = {
+    "contact": "INSERT INTO contact_submissions (name, email, phone, subject, message) VALUES (?, ?, ?, ?, ?)",
+    "feedback": "INSERT INTO feedback (username, email, rating, message) VALUES (?, ?, ?, ?)",
+}
+
+submission_limiter = RateLimiter(SUBMISSION_RATE_LIMIT, SUBMISSION_RATE_WINDOW)
+submission_queue = queue.Queue(maxsize=SUBMISSION_QUEUE_SIZE)
+submission_stop = threading.Event()
+
+def write_submissions(batch):
+    """Insert a batch of (kind, row) submissions in one transaction."""
+    conn = get_db()
+    try:
+        with conn:
+            for kind, sql in SUBMISSION_INSERTS.items():
+                rows = [row for row_kind, row in batch if row_kind == kind]
+                if rows:
+                    conn.executemany(sql, rows)
+    finally:
+        conn.close()
+
+def queue_submission(kind, row):
+    """Hand a public form submission to the batch writer; returns False if the queue is full."""
+    if SUBMISSION_SYNC_WRITES:
+        write_submissions([(kind, row)])
+        return True
+    try:
+        submission_queue.put_nowait((kind, row))
+        return True
+    except queue.Full:
+        return False
+
+def drain_submissions(first=None, wait=0):
+    """Take up to SUBMISSION_FLUSH_BATCH queued submissions, waiting up to `wait` seconds to fill the batch."""
+    batch = [first] if first else []
+    deadline = time.monotonic() + wait
+    while len(batch) < SUBMISSION_FLUSH_BATCH:
+        try:
+            batch.append(submission_queue.get(timeout=max(0, deadline - time.monotonic())) if wait
+                         else submission_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def submission_writer():
+    """Background loop that writes queued submissions in batches, off the request path."""
+    while not submission_stop.is_set():
+        try:
+            first = submission_queue.get(timeout=SUBMISSION_FLUSH_INTERVAL)
+        except queue.Empty:
+            continue
+        batch = drain_submissions(first, SUBMISSION_FLUSH_INTERVAL)
+        try:
+            write_submissions(batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} submissions: {e}")
+
+submission_writer_thread = threading.Thread(target=submission_writer, name="submission-writer", daemon=True)
+submission_writer_thread.start()
+
+@atexit.register
+def flush_submissions():
+    """On a clean exit, let the writer commit its in-flight batch, then write whatever is still queued."""
+    submission_stop.set()
+    submission_writer_thread.join(timeout=SUBMISSION_FLUSH_INTERVAL * 2 + 10)
+    while True:
+        batch = drain_submissions()
+        if not batch:
+            break
+        try:
+            write_submissions(batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} submissions: {e}")
+            break
+
 @app.route("/contact", methods=["GET", "POST"])
 def contact():
     """Contact page with integrated contact form and feedback submission."""
     
     contact_success = False
     feedback_success = False
+    submission_error = None
     
     if request.method == "POST":
         form_type = request.form.get("form_type")
@@ -527,31 +1297,15 @@ def contact():
             message = request.form.get("message", "").strip()
             
             if name and email and subject and message:
-                try:
-                    with get_db() as conn:
-                        # Create contact_submissions table if it doesn't exist
-                        conn.execute("""
-                            CREATE TABLE IF NOT EXISTS contact_submissions (
-                                submission_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                name TEXT NOT NULL,
-                                email TEXT NOT NULL,
-                                phone TEXT,
-                                subject TEXT NOT NULL,
-                                message TEXT NOT NULL,
-                                status TEXT DEFAULT 'new',
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        """)
-                        
-                        # Insert contact submission
-                        conn.execute("""
-                            INSERT INTO contact_submissions (name, email, phone, subject, message)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (name, email, phone, subject, message))
-                        conn.commit()
-                        contact_success = True
-                except Exception as e:
-                    print(f"Error saving contact submission: {e}")
+                if submission_limiter.allow(request.remote_addr or "unknown"):
+                    submission_error = "You've sent several messages recently. Please try again later."
+                else:
+                    try:
+                        contact_success = queue_submission("contact", (name, email, phone, subject, message))
+                        if not contact_success:
+                            submission_error = "We're receiving a lot of messages right now. Please try again shortly."
+                    except Exception as e:
+                        print(f"Error saving contact submission: {e}")
         
         # Handle Feedback Form Submission
         elif form_type == "feedback":
@@ -561,35 +1315,162 @@ def contact():
             feedback_message = request.form.get("feedback_message", "").strip()
             
             if username and rating and feedback_message and 1 <= rating <= 5:
-                try:
-                    with get_db() as conn:
-                        # Create feedback table if it doesn't exist
-                        conn.execute("""
-                            CREATE TABLE IF NOT EXISTS feedback (
-                                feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                username TEXT NOT NULL,
-                                email TEXT,
-                                rating INTEGER CHECK(rating >= 1 AND rating <= 5),
-                                message TEXT NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        """)
-                        
-                        # Insert feedback
-                        conn.execute("""
-                            INSERT INTO feedback (username, email, rating, message)
-                            VALUES (?, ?, ?, ?)
-                        """, (username, email, rating, feedback_message))
-                        conn.commit()
-                        feedback_success = True
-                except Exception as e:
-                    print(f"Error saving feedback: {e}")
+                if submission_limiter.allow(request.remote_addr or "unknown"):
+                    submission_error = "You've sent several messages recently. Please try again later."
+                else:
+                    try:
+                        feedback_success = queue_submission("feedback", (username, email, rating, feedback_message))
+                        if not feedback_success:
+                            submission_error = "We're receiving a lot of messages right now. Please try again shortly."
+                    except Exception as e:
+                        print(f"Error saving feedback: {e}")
     
     return render_template("contact.html", 
                          contact_success=contact_success,
                          feedback_success=feedback_success,
+                         submission_error=submission_error,
                          role="customer")
 
+# === ORDER EVENT STREAM ===
+ORDER_EVENT_BUFFER = 500   # recent events kept so reconnecting boards can catch up
+ORDER_EVENT_WAIT = 15      # seconds a stream/poll waits before a keepalive
+
+class OrderEventBus:
+    """
+    In-process pub/sub for order board events with a bounded replay buffer.
+    Event ids increase monotonically; a client whose cursor has fallen out of
+    the buffer (or predates a restart) is told to resync by reloading.
+    Boards served by other worker processes only see their own process's events.
+    """
+    def __init__(self, size=ORDER_EVENT_BUFFER):
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+        self.cond = threading.Condition()
+
+    def publish(self, event_type, **payload):
+        with self.cond:
+            self.last_id += 1
+            self.events.append(dict(payload, id=self.last_id, type=event_type,
+                                    at=datetime.now().isoformat(timespec="seconds")))
+            self.cond.notify_all()
+
+    def since(self, after_id, timeout=ORDER_EVENT_WAIT):
+        """Events newer than after_id, waiting up to timeout for one. Returns (events, resync)."""
+        with self.cond:
+            oldest = self.events[0]['id'] if self.events else self.last_id + 1
+            if after_id > self.last_id or after_id < oldest - 1:
+                return [], True
+            if after_id == self.last_id:
+                self.cond.wait(timeout)
+            return [event for event in self.events if event['id'] > after_id], False
+
+order_event_bus = OrderEventBus()
+
+@app.route("/api/orders/events")
+@require_staff
+def order_event_stream():
+    """API: Push new orders and status moves to staff boards (SSE, or long-poll with ?mode=poll)."""
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    after = request.args.get("after", type=int)
+    if after is None:
+        after = request.headers.get("Last-Event-ID", order_event_bus.last_id, type=int)
+
+    if request.args.get("mode") == "poll":
+        events, resync = order_event_bus.since(after)
+        cursor = order_event_bus.last_id if resync else (events[-1]['id'] if events else after)
+        return jsonify({"success": True, "events": events, "cursor": cursor, "resync": resync})
+
+    def stream():
+        cursor = after
+        yield "retry: 3000\n\n"
+        while True:
+            events, resync = order_event_bus.since(cursor)
+            if resync:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            cursor = events[-1]['id']
+
+    response = app.response_class(stream_with_context(stream()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+ORDERS_PER_PAGE = 20
+
+def encode_keyset_cursor(sort_value, row_id):
+    """Opaque paging cursor for a row's (sort value, id) position."""
+    return base64.urlsafe_b64encode(f"{sort_value}|{row_id}".encode()).decode()
+
+def decode_keyset_cursor(cursor):
+    """Return (sort value, id) from a cursor, or None if missing/invalid."""
+    if not cursor:
+        return None
+    try:
+        sort_value, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        row_id = int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return (sort_value, row_id) if abs(row_id) <= SQLITE_INT_MAX else None
+
+def fetch_keyset_page(conn, select_sql, where_clauses, params, sort_col, id_col, after, before, per_page):
+    """
+    Newest-first keyset page: rows strictly after (older than) or before (newer
+    than) a decoded cursor, never OFFSET. select_sql is "SELECT ... FROM ...".
+    Returns (rows, prev_cursor, next_cursor); cursors are None at either end.
+    """
+    where_clauses = list(where_clauses)
+    params = list(params)
+    cursor = after or before
+    if cursor:
+        where_clauses.append(f"({sort_col}, {id_col}) {'<' if after else '>'} (?, ?)")
+        params.extend(cursor)
+    direction = "ASC" if before else "DESC"
+    where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+
+    rows = conn.execute(f"""
+        {select_sql}
+        {where_sql}
+        ORDER BY {sort_col} {direction}, {id_col} {direction}
+        LIMIT ?
+    """, params + [per_page + 1]).fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    has_newer = has_more if before else cursor is not None
+    has_older = True if before else has_more
+    sort_key, id_key = sort_col.split(".")[-1], id_col.split(".")[-1]
+    prev_cursor = encode_keyset_cursor(rows[0][sort_key], rows[0][id_key]) if rows and has_newer else None
+    next_cursor = encode_keyset_cursor(rows[-1][sort_key], rows[-1][id_key]) if rows and has_older else None
+    return rows, prev_cursor, next_cursor
+
+def like_escape(text):
+    """Escape LIKE wildcards so text matches literally (use with ESCAPE '\\')."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def order_search_clause(search_query):
+    """
+    WHERE fragment for the orders search box, built so each term can use an index:
+    digits match an order id or a phone prefix, anything else a username or
+    payment type prefix. Returns (sql, params), or (None, []) for an empty query.
+    """
+    term = search_query.lstrip("#").strip()
+    if not term:
+        return None, []
+    prefix = like_escape(term) + "%"
+    if term.isascii() and term.isdigit():
+        if int(term) > SQLITE_INT_MAX:
+            return "customer_phone LIKE ? ESCAPE '\\'", [prefix]
+        return "(id = ? OR customer_phone LIKE ? ESCAPE '\\')", [int(term), prefix]
+    return "(username LIKE ? ESCAPE '\\' OR payment_type LIKE ? ESCAPE '\\')", [prefix, prefix]
+
 @app.route("/orders")
 @require_staff  # All staff can view orders
 def orders():
@@ -599,76 +1480,68 @@ def orders():
         flash("Access denied. Orders management is for employees only.", "danger")
         return redirect(url_for('home'))
     
-    tabs = ["Incoming", "In Progress", "Awaiting Pickup", "Out for Delivery", "Completed", "Issues"]
+    tabs = ["Incoming", "In Progress", "Awaiting Pickup", "Out for Delivery", "Completed", "Issues", "Cancelled"]
     active_tab = request.args.get("tab", "Incoming").strip()
     
     if active_tab not in tabs:
         active_tab = "Incoming"
     
-    page = request.args.get("page", 1, type=int)
     search_query = request.args.get("search", "").strip()
-    per_page = 20
-    offset = (page - 1) * per_page
+    after = decode_keyset_cursor(request.args.get("after"))
+    before = None if after else decode_keyset_cursor(request.args.get("before"))
+    per_page = ORDERS_PER_PAGE
+    # Archived orders are only read when explicitly asked for, from the Completed / Cancelled tabs
+    show_archived = active_tab in FINISHED_STATUSES and request.args.get("archived") == "1"
+    orders_table, items_table = (
+        (ARCHIVE_TABLES["transactions"], ARCHIVE_TABLES["order_items"]) if show_archived
+        else ("transactions", "order_items")
+    )
+    # Taken before querying so the live board replays anything that lands meanwhile
+    events_cursor = order_event_bus.last_id
     
     with get_db() as conn:
-        # Get counts for all tabs
-        counts = {}
-        for tab in tabs:
-            count = conn.execute(
-                "SELECT COUNT(*) FROM transactions WHERE status = ?",
-                (tab,)
-            ).fetchone()[0]
-            counts[tab] = count
+        # Counts for all tabs in one pass over the status index
+        counts = dict.fromkeys(tabs, 0)
+        for row in conn.execute("SELECT status, COUNT(*) FROM transactions GROUP BY status"):
+            if row[0] in counts:
+                counts[row[0]] = row[1]
         
-        where_clauses = ["status = ?"]
+        search_sql, search_params = order_search_clause(search_query)
+        # While searching, "+status" keeps the planner on the search index (few rows to sort);
+        # otherwise (status, timestamp, id) serves both the filter and the order
+        where_clauses = ["+status = ?" if search_sql else "status = ?"]
         params = [active_tab]
+        if search_sql:
+            where_clauses.append(search_sql)
+            params.extend(search_params)
         
-        if search_query:
-            where_clauses.append("(username LIKE ? OR payment_type LIKE ?)")
-            like = f"%{search_query}%"
-            params.extend([like, like])
-        
-        where_sql = " WHERE " + " AND ".join(where_clauses)
-        
-        total_count = conn.execute(
-            f"SELECT COUNT(*) FROM transactions {where_sql}",
-            params
-        ).fetchone()[0]
-        
-        total_pages = (total_count + per_page - 1) // per_page
-        
-        # Fetch orders with their items (changed customer_email to customer_phone)
-        rows = conn.execute(
+        # Keyset paging: continue strictly after/before the cursor row
+        rows, prev_cursor, next_cursor = fetch_keyset_page(
+            conn,
             f"""
             SELECT id, username, payment_type, amount, status, 
                    fulfillment_method, fulfillment_details, 
                    COALESCE(customer_phone, customer_email, '') as customer_phone, 
                    timestamp
-            FROM transactions
-            {where_sql}
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
+            FROM {orders_table}
             """,
-            params + [per_page, offset]
-        ).fetchall()
+            where_clauses, params, "timestamp", "id", after, before, per_page
+        )
         
-        # Fetch order items for each order
-        orders_with_items = []
-        for row in rows:
-            order_dict = dict(row)
-            order_id = order_dict['id']
-            
-            # Get items for this order
-            items = conn.execute(
-                """SELECT inventory_id, product_name, product_sku, quantity, unit_price, image_url
-                   FROM order_items
-                   WHERE order_id = ?
-                   ORDER BY item_id""",
-                (order_id,)
-            ).fetchall()
-            
-            order_dict['order_items'] = [dict(item) for item in items]
-            orders_with_items.append(order_dict)
+        # Fetch the items for every order on the page in one query
+        orders_with_items = [dict(row, order_items=[]) for row in rows]
+        by_id = {order['id']: order for order in orders_with_items}
+        if by_id:
+            placeholders = ",".join("?" * len(by_id))
+            for item in conn.execute(
+                f"""SELECT order_id, inventory_id, product_name, product_sku, quantity, unit_price, image_url
+                    FROM {items_table}
+                    WHERE order_id IN ({placeholders})
+                    ORDER BY order_id, item_id""",
+                list(by_id)
+            ):
+                item = dict(item)
+                by_id[item.pop('order_id')]['order_items'].append(item)
     
     return render_template(
         "orders.html",
@@ -676,12 +1549,88 @@ def orders():
         active_tab=active_tab,
         orders_list=orders_with_items,
         counts=counts,
-        current_page=page,
-        total_pages=total_pages,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+        events_cursor=events_cursor,
+        show_archived=show_archived,
         search_query=search_query,
         role=session.get("role"),
     )
 
+# === ORDER STATUS STATE MACHINE ===
+ORDER_STATUSES = ["Incoming", "In Progress", "Awaiting Pickup", "Out for Delivery", "Completed", "Issues"]
+ORDER_TRANSITIONS = {
+    "Incoming": {"In Progress", "Issues"},
+    "In Progress": {"Awaiting Pickup", "Out for Delivery", "Issues"},
+    "Awaiting Pickup": {"Completed", "Issues"},
+    "Out for Delivery": {"Completed", "Issues"},
+    "Issues": {"Incoming"},
+    "Completed": set(),
+}
+# Extra per-target conditions on the order row
+STATUS_CONDITIONS = {
+    "Awaiting Pickup": "COALESCE(fulfillment_method, 'pickup') = 'pickup'",
+    "Out for Delivery": "COALESCE(fulfillment_method, 'pickup') != 'pickup'",
+}
+STATUS_BULK_LIMIT = 5000
+
+def transition_orders(conn, order_ids, new_status, changed_by=None):
+    """
+    Move orders to new_status where the state machine allows it, one set-based
+    INSERT (audit) + UPDATE per chunk of ids. Call inside a write transaction.
+    Returns per-order results in input order and the list of changed orders.
+    """
+    sources = [status for status, targets in ORDER_TRANSITIONS.items() if new_status in targets]
+    condition = STATUS_CONDITIONS.get(new_status)
+    results = {}
+    changed = []
+    for chunk in chunked(order_ids, LOOKUP_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+        current = {
+            row['id']: row for row in conn.execute(f"""
+                SELECT id, status, COALESCE(fulfillment_method, 'pickup') AS fulfillment_method
+                FROM transactions WHERE id IN ({placeholders})
+            """, chunk)
+        }
+        updated = set()
+        if sources:
+            predicate = (f"id IN ({placeholders}) AND status IN ({','.join('?' * len(sources))})"
+                         + (f" AND {condition}" if condition else ""))
+            conn.execute(f"""
+                INSERT INTO order_status_transitions (order_id, from_status, to_status, changed_by)
+                SELECT id, status, ?, ? FROM transactions WHERE {predicate}
+            """, [new_status, changed_by] + chunk + sources)
+            updated = {row[0] for row in conn.execute(
+                f"UPDATE transactions SET status = ? WHERE {predicate} RETURNING id",
+                [new_status] + chunk + sources
+            )}
+
+        for order_id in chunk:
+            row = current.get(order_id)
+            if order_id in updated:
+                results[order_id] = {"order_id": order_id, "success": True,
+                                     "from_status": row['status'], "status": new_status}
+                changed.append((order_id, row['status']))
+            elif not row:
+                results[order_id] = {"order_id": order_id, "success": False, "message": "Order not found"}
+            elif row['status'] == new_status:
+                results[order_id] = {"order_id": order_id, "success": False, "status": row['status'],
+                                     "message": f"Order is already {new_status}"}
+            elif new_status in ORDER_TRANSITIONS.get(row['status'], ()):
+                results[order_id] = {"order_id": order_id, "success": False, "status": row['status'],
+                                     "message": f"{new_status} does not apply to {row['fulfillment_method']} orders"}
+            else:
+                results[order_id] = {"order_id": order_id, "success": False, "status": row['status'],
+                                     "message": f"Cannot move order from {row['status']} to {new_status}"}
+    # Completed web orders become sales invoices in the same transaction
+    if new_status == "Completed" and changed:
+        bridge_orders(conn, [order_id for order_id, _ in changed], GST_RATE)
+    return [results[order_id] for order_id in order_ids], changed
+
+def publish_status_changes(changed, new_status):
+    for order_id, from_status in changed:
+        order_event_bus.publish("status_changed", order_id=order_id, from_status=from_status, status=new_status)
+
 @app.route("/api/update-order-status/<int:order_id>", methods=["POST"])
 @csrf.exempt
 @require_staff
@@ -697,80 +1646,329 @@ def update_order_status(order_id):
         if not new_status:
             return jsonify({"success": False, "message": "Status is required"}), 400
         
-        valid_statuses = ["Incoming", "In Progress", "Awaiting Pickup", "Out for Delivery", "Completed", "Issues"]
-        if new_status not in valid_statuses:
+        if new_status not in ORDER_STATUSES:
             return jsonify({"success": False, "message": "Invalid status"}), 400
         
         with get_db() as conn:
-            order = conn.execute(
-                "SELECT * FROM transactions WHERE id = ?",
-                (order_id,)
-            ).fetchone()
-            
-            if not order:
-                return jsonify({"success": False, "message": "Order not found"}), 404
-            
-            conn.execute(
-                "UPDATE transactions SET status = ? WHERE id = ?",
-                (new_status, order_id)
-            )
+            conn.execute("BEGIN IMMEDIATE")
+            (result,), changed = transition_orders(conn, [order_id], new_status, session.get("username"))
             conn.commit()
-            
-            return jsonify({
-                "success": True,
-                "message": f"Order moved to {new_status}"
-            })
+        
+        if not result['success']:
+            code = 404 if result['message'] == "Order not found" else 409
+            return jsonify({"success": False, "message": result['message']}), code
+        publish_status_changes(changed, new_status)
+        return jsonify({
+            "success": True,
+            "message": f"Order moved to {new_status}"
+        })
             
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/api/orders/bulk-status", methods=["POST"])
+@csrf.exempt
+@require_staff
+def bulk_update_order_status():
+    """API: Move many orders to one status in a single transaction, with per-order results."""
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    data = request.get_json(silent=True) or {}
+    new_status = str(data.get('status', '')).strip()
+    if new_status not in ORDER_STATUSES:
+        return jsonify({"success": False, "message": "Invalid status"}), 400
+    order_ids = parse_id_list(data.get('order_ids', []))
+    if order_ids is None:
+        return jsonify({"success": False, "message": "order_ids must be a list of order ids"}), 400
+    if not order_ids:
+        return jsonify({"success": False, "message": "No orders given"}), 400
+    if len(order_ids) > STATUS_BULK_LIMIT:
+        return jsonify({"success": False, "message": f"At most {STATUS_BULK_LIMIT} orders per request"}), 400
+
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            results, changed = transition_orders(conn, order_ids, new_status, session.get("username"))
+            conn.commit()
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    publish_status_changes(changed, new_status)
+    return jsonify({
+        "success": True,
+        "status": new_status,
+        "updated": len(changed),
+        "failed": len(results) - len(changed),
+        "results": results
+    })
+
+# === PICK LISTS ===
+PICKABLE_STATUSES = ("Incoming", "In Progress")
+PICK_LIST_LIMIT = 200  # orders per pick list
+
+def shelf_sort_key(location):
+    """
+    Natural sort key for loc_on_shelf: 'A3-12' -> (('A',), (3, 12)).
+    The leading letters name the aisle; the numbers are positions along it.
+    Items without a location sort last.
+    """
+    if not location or not location.strip():
+        return ((chr(0x10FFFF),), ())
+    parts = re.findall(r"[A-Za-z]+|\d+", location.upper())
+    aisle = tuple(p for p in parts if not p.isdigit()) or ("",)
+    positions = tuple(int(p) for p in parts if p.isdigit())
+    return aisle, positions
+
+def walking_order(lines):
+    """Sort pick lines aisle by aisle, reversing every other aisle (serpentine walk)."""
+    by_aisle = defaultdict(list)
+    for line in lines:
+        by_aisle[shelf_sort_key(line['loc_on_shelf'])[0]].append(line)
+    ordered = []
+    for n, aisle in enumerate(sorted(by_aisle)):
+        aisle_lines = sorted(by_aisle[aisle], key=lambda line: shelf_sort_key(line['loc_on_shelf'])[1])
+        ordered.extend(reversed(aisle_lines) if n % 2 else aisle_lines)
+    return ordered
+
+def build_pick_list(conn, order_ids):
+    """Aggregate items across pickable orders in one query; returns (lines in walking order, picked order ids)."""
+    placeholders = ",".join("?" * len(order_ids))
+    status_placeholders = ",".join("?" * len(PICKABLE_STATUSES))
+    rows = conn.execute(f"""
+        SELECT oi.inventory_id,
+               MAX(oi.product_name) AS product_name,
+               MAX(oi.product_sku) AS product_sku,
+               i.loc_on_shelf,
+               i.qty AS on_hand,
+               SUM(oi.quantity) AS pick_qty,
+               GROUP_CONCAT(oi.order_id || ':' || oi.quantity) AS breakdown
+        FROM order_items oi
+        JOIN transactions t ON t.id = oi.order_id
+        LEFT JOIN inventory i ON i.inventory_id = oi.inventory_id
+        WHERE oi.order_id IN ({placeholders}) AND t.status IN ({status_placeholders})
+        GROUP BY oi.inventory_id
+    """, list(order_ids) + list(PICKABLE_STATUSES)).fetchall()
+
+    lines = []
+    picked = set()
+    for row in rows:
+        line = dict(row)
+        per_order = defaultdict(int)
+        for part in line.pop('breakdown').split(','):
+            order_id, qty = part.split(':')
+            per_order[int(order_id)] += int(qty)
+        line['orders'] = [{"order_id": oid, "quantity": qty} for oid, qty in sorted(per_order.items())]
+        picked.update(per_order)
+        lines.append(line)
+    return walking_order(lines), sorted(picked)
+
+@app.route("/orders/pick-list")
+@require_staff
+def pick_list():
+    """Printable shelf-ordered pick list for several Incoming / In Progress orders (?ids=1,2,3)."""
+    if session.get("role") == "admin":
+        flash("Access denied. Orders management is for employees only.", "danger")
+        return redirect(url_for('home'))
+    want_json = request.args.get("format") == "json"
+    try:
+        order_ids = list(dict.fromkeys(int(x) for x in request.args.get("ids", "").split(",") if x.strip()))
+    except ValueError:
+        order_ids = None
+    if order_ids and any(abs(order_id) > SQLITE_INT_MAX for order_id in order_ids):
+        message = "Invalid order id"
+    elif not order_ids or len(order_ids) > PICK_LIST_LIMIT:
+        message = f"Give between 1 and {PICK_LIST_LIMIT} order ids"
+    else:
+        message = None
+    if message:
+        if want_json:
+            return jsonify({"success": False, "message": message}), 400
+        flash(message, "danger")
+        return redirect(url_for('orders'))
+
+    with get_db() as conn:
+        lines, picked = build_pick_list(conn, order_ids)
+    skipped = [order_id for order_id in order_ids if order_id not in picked]
+
+    if want_json:
+        return jsonify({"success": True, "orders": picked, "skipped": skipped, "lines": lines,
+                        "total_units": sum(line['pick_qty'] for line in lines)})
+    return render_template("pick_list.html", lines=lines, orders=picked, skipped=skipped,
+                           total_units=sum(line['pick_qty'] for line in lines),
+                           generated_at=datetime.now().strftime("%d %b %Y %H:%M"))
+
+# === ORDER CANCELLATION ===
+CANCELLED_STATUS = "Cancelled"
+# Completed orders are final (and may already be invoiced)
+CANCELLABLE_STATUSES = ("Incoming", "In Progress", "Awaiting Pickup", "Out for Delivery", "Issues")
+
+def cancel_orders(conn, order_ids, cancelled_by=None):
+    """
+    Soft-cancel orders and put their stock back, a fixed number of statements
+    per chunk of ids: status UPDATE ... RETURNING, one UPDATE ... FROM restoring
+    inventory, one ledger insert. Call inside a write transaction.
+    Returns per-order results in input order and the list of cancelled orders.
+    """
+    results = {}
+    cancelled = []
+    status_placeholders = ",".join("?" * len(CANCELLABLE_STATUSES))
+    for chunk in chunked(order_ids, LOOKUP_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+        current = dict(conn.execute(
+            f"SELECT id, status FROM transactions WHERE id IN ({placeholders})", chunk
+        ).fetchall())
+        predicate = f"id IN ({placeholders}) AND status IN ({status_placeholders})"
+        conn.execute(f"""
+            INSERT INTO order_status_transitions (order_id, from_status, to_status, changed_by)
+            SELECT id, status, ?, ? FROM transactions WHERE {predicate}
+        """, [CANCELLED_STATUS, cancelled_by] + chunk + list(CANCELLABLE_STATUSES))
+        done = [row[0] for row in conn.execute(f"""
+            UPDATE transactions
+            SET status = ?, cancelled_at = CURRENT_TIMESTAMP, cancelled_by = ?
+            WHERE {predicate}
+            RETURNING id
+        """, [CANCELLED_STATUS, cancelled_by] + chunk + list(CANCELLABLE_STATUSES))]
+
+        if done:
+            done_placeholders = ",".join("?" * len(done))
+            conn.execute(f"""
+                UPDATE inventory
+                SET qty = inventory.qty + restored.restored_qty, row_version = inventory.row_version + 1
+                FROM (SELECT inventory_id, SUM(quantity) AS restored_qty FROM order_items
+                      WHERE order_id IN ({done_placeholders}) GROUP BY inventory_id) AS restored
+                WHERE inventory.inventory_id = restored.inventory_id
+            """, done)
+            record_movements(conn, [
+                (row['inventory_id'], 'cancellation', row['qty'], f"order:{row['order_id']}")
+                for row in conn.execute(f"""
+                    SELECT order_id, inventory_id, SUM(quantity) AS qty FROM order_items
+                    WHERE order_id IN ({done_placeholders}) GROUP BY order_id, inventory_id
+                """, done)
+            ], created_by=cancelled_by)
+
+        done = set(done)
+        for order_id in chunk:
+            status = current.get(order_id)
+            if order_id in done:
+                results[order_id] = {"order_id": order_id, "success": True, "from_status": status}
+                cancelled.append((order_id, status))
+            elif status is None:
+                results[order_id] = {"order_id": order_id, "success": False, "message": "Order not found"}
+            elif status == CANCELLED_STATUS:
+                results[order_id] = {"order_id": order_id, "success": False, "status": status,
+                                     "message": "Order is already cancelled"}
+            else:
+                results[order_id] = {"order_id": order_id, "success": False, "status": status,
+                                     "message": f"{status} orders cannot be cancelled"}
+    return [results[order_id] for order_id in order_ids], cancelled
+
+def publish_cancellations(cancelled):
+    for order_id, from_status in cancelled:
+        order_event_bus.publish("order_cancelled", order_id=order_id, from_status=from_status,
+                                status=CANCELLED_STATUS)
+
 @app.route("/api/cancel-order/<int:order_id>", methods=["DELETE"])
 @csrf.exempt
 @require_staff
 def cancel_order(order_id):
-    """API: Cancel/delete an order from the system and restore inventory."""
+    """API: Cancel an order (kept as Cancelled for history) and restore inventory."""
     # Admin should NOT have access to orders
     if session.get("role") == "admin":
         return jsonify({"success": False, "message": "Access denied"}), 403
     try:
         with get_db() as conn:
-            order = conn.execute(
-                "SELECT * FROM transactions WHERE id = ?",
-                (order_id,)
-            ).fetchone()
-            
-            if not order:
-                return jsonify({"success": False, "message": "Order not found"}), 404
-            
-            # Get order items to restore inventory
-            order_items = conn.execute(
-                "SELECT inventory_id, quantity FROM order_items WHERE order_id = ?",
-                (order_id,)
-            ).fetchall()
-            
-            # Restore inventory for each item
-            for item in order_items:
-                conn.execute(
-                    """UPDATE inventory 
-                       SET qty = qty + ? 
-                       WHERE inventory_id = ?""",
-                    (item['quantity'], item['inventory_id'])
-                )
-            
-            # Delete order items first (foreign key constraint)
-            conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
-            # Delete the order
-            conn.execute("DELETE FROM transactions WHERE id = ?", (order_id,))
+            conn.execute("BEGIN IMMEDIATE")
+            (result,), cancelled = cancel_orders(conn, [order_id], session.get("username"))
             conn.commit()
-            
-            return jsonify({
-                "success": True,
-                "message": "Order cancelled successfully and inventory restored"
-            })
+        
+        if not result['success']:
+            code = 404 if result['message'] == "Order not found" else 409
+            return jsonify({"success": False, "message": result['message']}), code
+        publish_cancellations(cancelled)
+        return jsonify({
+            "success": True,
+            "message": "Order cancelled successfully and inventory restored"
+        })
             
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/api/orders/bulk-cancel", methods=["POST"])
+@csrf.exempt
+@require_staff
+def bulk_cancel_orders():
+    """API: Cancel many orders in one transaction, with per-order results."""
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    data = request.get_json(silent=True) or {}
+    order_ids = parse_id_list(data.get('order_ids', []))
+    if order_ids is None:
+        return jsonify({"success": False, "message": "order_ids must be a list of order ids"}), 400
+    if not order_ids:
+        return jsonify({"success": False, "message": "No orders given"}), 400
+    if len(order_ids) > STATUS_BULK_LIMIT:
+        return jsonify({"success": False, "message": f"At most {STATUS_BULK_LIMIT} orders per request"}), 400
+
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            results, cancelled = cancel_orders(conn, order_ids, session.get("username"))
+            conn.commit()
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    publish_cancellations(cancelled)
+    return jsonify({
+        "success": True,
+        "cancelled": len(cancelled),
+        "failed": len(results) - len(cancelled),
+        "results": results
+    })
+
+INBOX_PER_PAGE = 25
+INBOX_SEARCH_LIMIT = 100  # ranked search results shown, best first
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"  # placeholders, swapped for <mark> after escaping
+
+def fts_match_query(search_query):
+    """FTS5 MATCH expression for a search box: every word as a quoted prefix term, all required."""
+    words = re.findall(r"\w+", search_query)
+    return " ".join(f'"{word}"*' for word in words) or None
+
+def highlight_snippet(snippet):
+    """Escape an FTS snippet and turn its match placeholders into <mark> tags."""
+    return Markup(str(escape(snippet)).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>"))
+
+def search_inbox(conn, fts_table, table, id_col, columns, match, where_clauses, params):
+    """
+    Best-matching rows of an inbox for an FTS5 MATCH expression, ranked by bm25,
+    with a highlighted 'snippet' of the message. where_clauses must be qualified
+    with the table name.
+    """
+    indexed = next(cols for fts, _, _, cols in INBOX_FTS if fts == fts_table)
+    message_col = indexed.index("message")
+    where_sql = "".join(f" AND {clause}" for clause in where_clauses)
+    rows = conn.execute(f"""
+        SELECT {", ".join(f"{table}.{col}" for col in columns)},
+               snippet({fts_table}, {message_col}, ?, ?, '…', 24) AS snippet
+        FROM {fts_table}
+        JOIN {table} ON {table}.{id_col} = {fts_table}.rowid
+        WHERE {fts_table} MATCH ?{where_sql}
+        ORDER BY {fts_table}.rank
+        LIMIT ?
+    """, [SNIPPET_OPEN, SNIPPET_CLOSE, match, *params, INBOX_SEARCH_LIMIT]).fetchall()
+    results = []
+    for row in rows:
+        item = dict(row)
+        item['snippet'] = highlight_snippet(item['snippet'])
+        results.append(item)
+    return results
+
+def get_inbox_stats(conn, inbox):
+    """Trigger-maintained counters for an inbox ('feedback' or 'contact') as {bucket: value}."""
+    return {row['bucket']: row['value'] for row in conn.execute(
+        "SELECT bucket, value FROM inbox_stats WHERE inbox = ?", (inbox,)
+    )}
+
 @app.route("/feedback")
 @require_staff  # All staff can view feedback
 def feedback():
@@ -780,118 +1978,89 @@ def feedback():
     rating_filter = request.args.get('rating', type=int)
     status_filter = request.args.get('status', '')
     subject_filter = request.args.get('subject', '')
+    # Each inbox pages independently with its own keyset cursor
+    fb_after = decode_keyset_cursor(request.args.get('fb_after'))
+    fb_before = None if fb_after else decode_keyset_cursor(request.args.get('fb_before'))
+    msg_after = decode_keyset_cursor(request.args.get('msg_after'))
+    msg_before = None if msg_after else decode_keyset_cursor(request.args.get('msg_before'))
     
     with get_db() as conn:
-        # Ensure tables exist
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                email TEXT,
-                rating INTEGER CHECK(rating >= 1 AND rating <= 5),
-                message TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS contact_submissions (
-                submission_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                phone TEXT,
-                subject TEXT NOT NULL,
-                message TEXT NOT NULL,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
         # FETCH FEEDBACK (RATINGS)
         feedback_where = []
         feedback_params = []
         
-        if search_query and active_tab == 'ratings':
-            feedback_where.append("(username LIKE ? OR email LIKE ? OR message LIKE ?)")
-            feedback_params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-        
         if rating_filter:
-            feedback_where.append("rating = ?")
+            feedback_where.append("feedback.rating = ?")
             feedback_params.append(rating_filter)
         
-        feedback_where_sql = " WHERE " + " AND ".join(feedback_where) if feedback_where else ""
-        
-        feedback_list = conn.execute(f"""
-            SELECT feedback_id, username, email, rating, message, created_at
-            FROM feedback
-            {feedback_where_sql}
-            ORDER BY created_at DESC
-        """, feedback_params).fetchall()
-        
-        feedback_stats = conn.execute(f"""
-            SELECT 
-                COUNT(*) as total_feedback,
-                COALESCE(AVG(rating), 0) as avg_rating,
-                COUNT(CASE WHEN rating = 5 THEN 1 END) as five_star,
-                COUNT(CASE WHEN rating = 4 THEN 1 END) as four_star,
-                COUNT(CASE WHEN rating = 3 THEN 1 END) as three_star,
-                COUNT(CASE WHEN rating <= 2 THEN 1 END) as low_rating
-            FROM feedback
-            {feedback_where_sql}
-        """, feedback_params).fetchone()
+        feedback_match = fts_match_query(search_query) if active_tab == 'ratings' else None
+        if feedback_match:
+            # Ranked search results replace the paged list
+            feedback_list = search_inbox(
+                conn, "feedback_fts", "feedback", "feedback_id",
+                ("feedback_id", "username", "email", "rating", "message", "created_at"),
+                feedback_match, feedback_where, feedback_params
+            )
+            fb_prev = fb_next = None
+        else:
+            feedback_list, fb_prev, fb_next = fetch_keyset_page(
+                conn,
+                "SELECT feedback_id, username, email, rating, message, created_at FROM feedback",
+                feedback_where, feedback_params, "created_at", "feedback_id",
+                fb_after, fb_before, INBOX_PER_PAGE
+            )
+        feedback_stats = get_inbox_stats(conn, 'feedback')
         
         # FETCH CONTACT SUBMISSIONS (MESSAGES)
         submissions_where = []
         submissions_params = []
         
-        if search_query and active_tab == 'messages':
-            submissions_where.append("(name LIKE ? OR email LIKE ? OR message LIKE ?)")
-            submissions_params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-        
         if status_filter:
-            submissions_where.append("status = ?")
+            submissions_where.append("contact_submissions.status = ?")
             submissions_params.append(status_filter)
         
         if subject_filter:
-            submissions_where.append("subject = ?")
+            submissions_where.append("contact_submissions.subject = ?")
             submissions_params.append(subject_filter)
         
-        submissions_where_sql = " WHERE " + " AND ".join(submissions_where) if submissions_where else ""
-        
-        submissions_list = conn.execute(f"""
-            SELECT submission_id, name, email, phone, subject, message, status, created_at
-            FROM contact_submissions
-            {submissions_where_sql}
-            ORDER BY created_at DESC
-        """, submissions_params).fetchall()
-        
-        submissions_stats = conn.execute(f"""
-            SELECT 
-                COUNT(*) as total_submissions,
-                COUNT(CASE WHEN status = 'new' THEN 1 END) as new_count,
-                COUNT(CASE WHEN status = 'attended' THEN 1 END) as attended_count,
-                COUNT(CASE WHEN status = 'in-progress' THEN 1 END) as in_progress_count,
-                COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed_count
-            FROM contact_submissions
-            {submissions_where_sql}
-        """, submissions_params).fetchone()
+        submissions_match = fts_match_query(search_query) if active_tab == 'messages' else None
+        if submissions_match:
+            submissions_list = search_inbox(
+                conn, "contact_fts", "contact_submissions", "submission_id",
+                ("submission_id", "name", "email", "phone", "subject", "message", "status", "created_at"),
+                submissions_match, submissions_where, submissions_params
+            )
+            msg_prev = msg_next = None
+        else:
+            submissions_list, msg_prev, msg_next = fetch_keyset_page(
+                conn,
+                "SELECT submission_id, name, email, phone, subject, message, status, created_at FROM contact_submissions",
+                submissions_where, submissions_params, "created_at", "submission_id",
+                msg_after, msg_before, INBOX_PER_PAGE
+            )
+        submissions_stats = get_inbox_stats(conn, 'contact')
     
+    total_feedback = feedback_stats.get('total', 0)
     return render_template("feedback.html",
                          # Feedback data
                          feedback=[dict(row) for row in feedback_list],
-                         total_feedback=feedback_stats['total_feedback'],
-                         avg_rating=round(float(feedback_stats['avg_rating']), 2),
-                         five_star=feedback_stats['five_star'],
-                         four_star=feedback_stats['four_star'],
-                         three_star=feedback_stats['three_star'],
-                         low_rating=feedback_stats['low_rating'],
+                         total_feedback=total_feedback,
+                         avg_rating=round(feedback_stats.get('rating_sum', 0) / total_feedback, 2) if total_feedback else 0,
+                         five_star=feedback_stats.get('rating:5', 0),
+                         four_star=feedback_stats.get('rating:4', 0),
+                         three_star=feedback_stats.get('rating:3', 0),
+                         low_rating=feedback_stats.get('rating:2', 0) + feedback_stats.get('rating:1', 0),
+                         fb_prev=fb_prev,
+                         fb_next=fb_next,
                          # Contact submissions data
                          submissions=[dict(row) for row in submissions_list],
-                         total_submissions=submissions_stats['total_submissions'],
-                         new_count=submissions_stats['new_count'],
-                         attended_count=submissions_stats['attended_count'],
-                         in_progress_count=submissions_stats['in_progress_count'],
-                         completed_count=submissions_stats['completed_count'],
+                         total_submissions=submissions_stats.get('total', 0),
+                         new_count=submissions_stats.get('status:new', 0),
+                         attended_count=submissions_stats.get('status:attended', 0),
+                         in_progress_count=submissions_stats.get('status:in-progress', 0),
+                         completed_count=submissions_stats.get('status:completed', 0),
+                         msg_prev=msg_prev,
+                         msg_next=msg_next,
                          # Filters
                          search_query=search_query,
                          rating_filter=rating_filter,
@@ -920,13 +2089,17 @@ def submit_feedback():
     if not rating or rating < 1 or rating > 5:
         return jsonify({"success": False, "message": "Rating must be between 1 and 5"}), 400
     
+    retry_after = submission_limiter.allow(request.remote_addr or "unknown")
+    if retry_after:
+        response = jsonify({"success": False, "message": "Too many submissions, please try again later"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+    
     try:
-        with get_db() as conn:
-            conn.execute("""
-                INSERT INTO feedback (username, email, rating, message)
-                VALUES (?, ?, ?, ?)
-            """, (username, email, rating, message))
-            conn.commit()
+        if not queue_submission("feedback", (username, email, rating, message)):
+            response = jsonify({"success": False, "message": "Feedback is busy, please try again shortly"})
+            response.headers["Retry-After"] = str(SUBMISSION_FLUSH_INTERVAL)
+            return response, 503
         
         return jsonify({"success": True, "message": "Feedback submitted successfully"})
     except Exception as e:
@@ -966,71 +2139,56 @@ def update_contact_status():
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route("/contact-submissions")
-@require_staff
-def contact_submissions():
-    """Staff page to view and manage contact form submissions."""
-    search_query = request.args.get('search', '')
-    status_filter = request.args.get('status', '')
-    subject_filter = request.args.get('subject', '')
-    
-    with get_db() as conn:
-        # Create table if it doesn't exist
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS contact_submissions (
-                submission_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                phone TEXT,
-                subject TEXT NOT NULL,
-                message TEXT NOT NULL,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        base_query = "FROM contact_submissions c"
+@app.route("/contact-submissions")
+@require_staff
+def contact_submissions():
+    """Staff page to view and manage contact form submissions."""
+    search_query = request.args.get('search', '')
+    status_filter = request.args.get('status', '')
+    subject_filter = request.args.get('subject', '')
+    after = decode_keyset_cursor(request.args.get('after'))
+    before = None if after else decode_keyset_cursor(request.args.get('before'))
+    
+    with get_db() as conn:
         where_clauses = []
         params = []
         
-        if search_query:
-            where_clauses.append("(c.name LIKE ? OR c.email LIKE ? OR c.message LIKE ?)")
-            params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-        
         if status_filter:
-            where_clauses.append("c.status = ?")
+            where_clauses.append("contact_submissions.status = ?")
             params.append(status_filter)
         
         if subject_filter:
-            where_clauses.append("c.subject = ?")
+            where_clauses.append("contact_submissions.subject = ?")
             params.append(subject_filter)
         
-        where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
-        
-        submissions_list = conn.execute(f"""
-            SELECT c.submission_id, c.name, c.email, c.phone, c.subject, c.message, c.status, c.created_at
-            {base_query} {where_sql}
-            ORDER BY c.created_at DESC
-        """, params).fetchall()
-        
-        stats = conn.execute(f"""
-            SELECT 
-                COUNT(*) as total_submissions,
-                COUNT(CASE WHEN status = 'new' THEN 1 END) as new_count,
-                COUNT(CASE WHEN status = 'in-progress' THEN 1 END) as in_progress_count,
-                COUNT(CASE WHEN status = 'resolved' THEN 1 END) as resolved_count
-            {base_query} {where_sql}
-        """, params).fetchone()
+        match = fts_match_query(search_query)
+        if match:
+            submissions_list = search_inbox(
+                conn, "contact_fts", "contact_submissions", "submission_id",
+                ("submission_id", "name", "email", "phone", "subject", "message", "status", "created_at"),
+                match, where_clauses, params
+            )
+            prev_cursor = next_cursor = None
+        else:
+            submissions_list, prev_cursor, next_cursor = fetch_keyset_page(
+                conn,
+                """SELECT submission_id, name, email, phone, subject, message, status, created_at
+                   FROM contact_submissions""",
+                where_clauses, params, "created_at", "submission_id", after, before, INBOX_PER_PAGE
+            )
+        stats = get_inbox_stats(conn, 'contact')
     
     return render_template("contact_submissions.html",
                          submissions=[dict(row) for row in submissions_list],
                          search_query=search_query,
                          status_filter=status_filter,
                          subject_filter=subject_filter,
-                         total_submissions=stats['total_submissions'],
-                         new_count=stats['new_count'],
-                         in_progress_count=stats['in_progress_count'],
-                         resolved_count=stats['resolved_count'],
+                         total_submissions=stats.get('total', 0),
+                         new_count=stats.get('status:new', 0),
+                         in_progress_count=stats.get('status:in-progress', 0),
+                         resolved_count=stats.get('status:resolved', 0),
+                         prev_cursor=prev_cursor,
+                         next_cursor=next_cursor,
                          role=session.get("role"))
 
 @app.route("/staff-login", methods=["GET", "POST"])
@@ -1222,42 +2380,135 @@ def api_get_inventory():
         return jsonify({"error": "Access denied"}), 403
     try:
         with get_db() as conn:
+            # Revalidate against the inventory version before running the full query
+            etag = f"inventory-v{get_data_version(conn, 'inventory')}"
+            cached = not_modified_response(etag, INVENTORY_CACHE_CONTROL)
+            if cached:
+                return cached
+
             # Get total count for KPI
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM inventory")
+            cursor.execute("SELECT COUNT(*) FROM inventory WHERE archived = 0")
             total_count = cursor.fetchone()[0]
             
             # Get ALL products ordered by newest first (inventory_id DESC)
+            # row_version belongs to the representative (newest) row that edits target
             bucket_select = """
-                SELECT
-                    hem_name,
-                    GROUP_CONCAT(DISTINCT sup_part_no) as sup_part_no,
-                    category,
-                    org,
-                    loc_on_shelf,
-                    SUM(qty)          as qty,
-                    MIN(sell_price)   as sell_price,
-                    MAX(sell_price)   as max_price,
-                    image_url,
-                    MAX(inventory_id) as inventory_id,
-                    COUNT(*)          as variant_count,
-                    MIN(sup_part_no)  as first_sku
-                FROM inventory
-                GROUP BY hem_name
-                ORDER BY inventory_id DESC
+                SELECT g.*, i.row_version
+                FROM (
+                    SELECT
+                        hem_name,
+                        GROUP_CONCAT(DISTINCT sup_part_no) as sup_part_no,
+                        category,
+                        org,
+                        loc_on_shelf,
+                        SUM(qty)          as qty,
+                        MIN(sell_price)   as sell_price,
+                        MAX(sell_price)   as max_price,
+                        image_url,
+                        MAX(inventory_id) as inventory_id,
+                        COUNT(*)          as variant_count,
+                        MIN(sup_part_no)  as first_sku
+                    FROM inventory
+                    WHERE archived = 0
+                    GROUP BY hem_name
+                ) g
+                JOIN inventory i ON i.inventory_id = g.inventory_id
+                ORDER BY g.inventory_id DESC
             """
             items = conn.execute(bucket_select).fetchall()
             
-            return jsonify({
+            return with_validators(jsonify({
                 'products': [dict(item) for item in items],
                 'total_count': total_count,
                 'displayed_count': len(items)
-            })
+            }), etag, INVENTORY_CACHE_CONTROL)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+INVENTORY_EXPORT_COLUMNS = ["inventory_id", "sup_part_no", "hem_name", "category", "org",
+                            "loc_on_shelf", "qty", "sell_price", "image_url", "archived"]
+EXPORT_FETCH_SIZE = 1000
+
+def gzip_stream(chunks):
+    """Gzip-compress an iterable of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route("/api/inventory/export", methods=["GET"])
+@csrf.exempt
+@require_staff
+def api_export_inventory():
+    """API: Stream the full inventory as NDJSON or CSV without buffering it in memory."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"error": "Access denied"}), 403
+
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    requested = [c.strip() for c in request.args.get('columns', '').split(',') if c.strip()]
+    unknown = [c for c in requested if c not in INVENTORY_EXPORT_COLUMNS]
+    if unknown:
+        return jsonify({"error": f"Unknown columns: {', '.join(unknown)}"}), 400
+    columns = requested or INVENTORY_EXPORT_COLUMNS
+
+    def generate_rows():
+        # Each batch is its own short keyset read, so a slow download never
+        # holds a read lock between chunks
+        select_columns = columns if "inventory_id" in columns else ["inventory_id"] + columns
+        conn = get_db()
+        try:
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            last_id = 0
+            while True:
+                rows = conn.execute(f"""
+                    SELECT {', '.join(select_columns)} FROM inventory
+                    WHERE inventory_id > ?
+                    ORDER BY inventory_id
+                    LIMIT ?
+                """, (last_id, EXPORT_FETCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]["inventory_id"]
+                if export_format == "csv":
+                    writer.writerows(tuple(row[c] for c in columns) for row in rows)
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    chunk = "".join(json.dumps({c: row[c] for c in columns}) + "\n" for row in rows)
+                yield chunk
+                if len(rows) < EXPORT_FETCH_SIZE:
+                    break
+        finally:
+            conn.close()
+
+    use_gzip = 'gzip' in request.accept_encodings
+    body = gzip_stream(generate_rows()) if use_gzip else generate_rows()
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"inventory_{date.today().isoformat()}.{export_format}"
+
+    response = app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route("/api/inventory", methods=["POST"])
 @csrf.exempt
 @require_staff
@@ -1289,7 +2540,7 @@ def api_create_inventory():
             new_product_id = cursor.lastrowid
             
             # Get updated total count
-            cursor.execute("SELECT COUNT(*) FROM inventory")
+            cursor.execute("SELECT COUNT(*) FROM inventory WHERE archived = 0")
             new_total_count = cursor.fetchone()[0]
             
             conn.commit()
@@ -1303,6 +2554,191 @@ def api_create_inventory():
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+# === BULK INVENTORY UPSERT ===
+INVENTORY_BULK_FIELDS = ["sup_part_no", "hem_name", "category", "org", "loc_on_shelf",
+                         "qty", "sell_price", "image_url"]
+BULK_CHUNK_SIZE = 5000   # rows per executemany batch
+LOOKUP_CHUNK_SIZE = 500  # keys per IN (...) lookup
+
+def chunked(seq, size):
+    """Yield successive slices of seq with at most size items."""
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+def load_bulk_frame():
+    """Read a bulk payload (uploaded CSV file or JSON array of rows) into a DataFrame."""
+    upload = request.files.get('file')
+    if upload:
+        return pd.read_csv(upload, dtype=str, keep_default_na=False, na_values=[''])
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('rows')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of rows or a CSV file upload")
+    return pd.DataFrame(data)
+
+def validate_bulk_frame(df):
+    """Normalize bulk rows column-wise and return (df, errors) with one error message per row."""
+    df = df.reindex(columns=["inventory_id"] + INVENTORY_BULK_FIELDS).astype(object)
+    df = df.where(df.notna(), None)
+
+    for col in ["sup_part_no", "hem_name", "category", "org", "loc_on_shelf", "image_url"]:
+        present = df[col].notna()
+        df.loc[present, col] = df.loc[present, col].astype(str).str.strip()
+
+    ids = pd.to_numeric(df["inventory_id"], errors="coerce")
+    qty = pd.to_numeric(df["qty"], errors="coerce")
+    price = pd.to_numeric(df["sell_price"], errors="coerce")
+
+    # Only whole numbers SQLite can store survive the integer casts below
+    ids = ids.where((ids % 1 == 0) & (ids.abs() < SQLITE_INT_MAX + 1))
+    qty = qty.where((qty % 1 == 0) & (qty.abs() < SQLITE_INT_MAX + 1))
+
+    errors = pd.Series("", index=df.index, dtype=object)
+    errors = errors.mask(df["sell_price"].notna() & (price.isna() | (price < 0)), "Invalid sell_price")
+    errors = errors.mask(df["qty"].notna() & (qty.isna() | (qty < 0)), "Invalid qty")
+    errors = errors.mask(df["hem_name"].notna() & (df["hem_name"] == ""), "Product name cannot be blank")
+    no_key = ids.isna() & (df["sup_part_no"].isna() | (df["sup_part_no"] == ""))
+    errors = errors.mask(df["inventory_id"].notna() & ids.isna(), "Invalid inventory_id")
+    errors = errors.mask(df["inventory_id"].isna() & no_key, "Row needs an inventory_id or sup_part_no")
+
+    df["inventory_id"] = ids.astype("Int64").astype(object).where(ids.notna(), None)
+    df["qty"] = qty.astype("Int64").astype(object).where(qty.notna(), None)
+    df["sell_price"] = price.astype(object).where(price.notna(), None)
+    return df, errors
+
+def lookup_existing_ids(conn, ids, parts):
+    """Return (existing inventory_ids, {sup_part_no: [inventory_id, ...]}) using chunked IN lookups."""
+    existing = set()
+    for chunk in chunked(list(ids), LOOKUP_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+        existing.update(row[0] for row in conn.execute(
+            f"SELECT inventory_id FROM inventory WHERE inventory_id IN ({placeholders})", chunk))
+    by_part = defaultdict(list)
+    for chunk in chunked(list(parts), LOOKUP_CHUNK_SIZE):
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(
+                f"SELECT sup_part_no, inventory_id FROM inventory WHERE sup_part_no IN ({placeholders})", chunk):
+            by_part[row[0]].append(row[1])
+    return existing, by_part
+
+@app.route("/api/inventory/bulk", methods=["POST"])
+@csrf.exempt
+@require_staff
+def api_bulk_upsert_inventory():
+    """API: Insert or update many inventory rows in one transaction (JSON array or CSV upload).
+
+    Rows are keyed by inventory_id, or by sup_part_no when no id is given. Missing
+    fields keep their current value. Pass ?atomic=1 to reject the whole batch if any
+    row is invalid; otherwise valid rows are applied and invalid rows are reported.
+    """
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    atomic = request.args.get('atomic', '0').lower() in ('1', 'true', 'yes')
+
+    try:
+        df, errors = validate_bulk_frame(load_bulk_frame())
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Could not read rows: {e}"}), 400
+
+    records = df.to_dict("records")
+    errors = errors.tolist()
+    outcomes = [None] * len(records)
+    updates, inserts = [], []
+
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            existing_ids, ids_by_part = lookup_existing_ids(
+                conn,
+                {r["inventory_id"] for r, err in zip(records, errors) if not err and r["inventory_id"] is not None},
+                {r["sup_part_no"] for r, err in zip(records, errors) if not err and r["inventory_id"] is None},
+            )
+
+            new_parts = {}
+            # One row per item, so each ledger delta is taken against the qty it replaces
+            target_rows = {}
+            for i, (row, err) in enumerate(zip(records, errors)):
+                target = row["inventory_id"]
+                if not err and target is None:
+                    matches = ids_by_part.get(row["sup_part_no"], [])
+                    if len(matches) > 1:
+                        err = f"sup_part_no matches {len(matches)} items; use inventory_id"
+                    elif matches:
+                        target = matches[0]
+                    elif not row["hem_name"]:
+                        err = "Product name is required for new items"
+                    elif row["sup_part_no"] in new_parts:
+                        err = f"Duplicate new sup_part_no (also on row {new_parts[row['sup_part_no']]})"
+                    else:
+                        new_parts[row["sup_part_no"]] = i
+                elif not err and target not in existing_ids:
+                    err = "Inventory item not found"
+                if not err and target is not None:
+                    if target in target_rows:
+                        err = f"Duplicate item (also on row {target_rows[target]})"
+                    else:
+                        target_rows[target] = i
+
+                if err:
+                    outcomes[i] = {"row": i, "status": "error", "message": err}
+                elif target is None:
+                    inserts.append((i, row))
+                else:
+                    updates.append((i, target, row))
+
+            failed = sum(1 for o in outcomes if o)
+            if atomic and failed:
+                conn.rollback()
+                return jsonify({
+                    "success": False,
+                    "message": f"{failed} invalid row(s); nothing was applied",
+                    "summary": {"total": len(records), "inserted": 0, "updated": 0, "errors": failed},
+                    "results": [o for o in outcomes if o],
+                }), 400
+
+            upload = request.files.get('file')
+            reference = f"bulk:{upload.filename}" if upload else "bulk"
+            for chunk in chunked(updates, BULK_CHUNK_SIZE):
+                record_qty_overwrites(conn, [(target, row["qty"], None) for _, target, row in chunk],
+                                      'import', reference, session.get("username"))
+                conn.executemany("""
+                    UPDATE inventory
+                    SET sup_part_no = COALESCE(?, sup_part_no), hem_name = COALESCE(?, hem_name),
+                        category = COALESCE(?, category), org = COALESCE(?, org),
+                        loc_on_shelf = COALESCE(?, loc_on_shelf), qty = COALESCE(?, qty),
+                        sell_price = COALESCE(?, sell_price), image_url = COALESCE(?, image_url),
+                        row_version = row_version + 1
+                    WHERE inventory_id = ?
+                """, [tuple(row[f] for f in INVENTORY_BULK_FIELDS) + (target,) for _, target, row in chunk])
+            for i, target, _ in updates:
+                outcomes[i] = {"row": i, "status": "updated", "inventory_id": target}
+
+            for chunk in chunked(inserts, BULK_CHUNK_SIZE):
+                conn.executemany("""
+                    INSERT INTO inventory (sup_part_no, hem_name, category, org, loc_on_shelf, qty, sell_price, image_url)
+                    VALUES (?, ?, COALESCE(?, 'Lubricants'), ?, ?, COALESCE(?, 0), COALESCE(?, 0), COALESCE(?, ''))
+                """, [tuple(row[f] for f in INVENTORY_BULK_FIELDS) for _, row in chunk])
+                # AUTOINCREMENT ids are consecutive while we hold the write lock
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                for offset, (i, _) in enumerate(chunk):
+                    outcomes[i] = {"row": i, "status": "inserted",
+                                   "inventory_id": last_id - len(chunk) + 1 + offset}
+
+            conn.commit()
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return jsonify({
+        "success": True,
+        "message": f"{len(updates)} updated, {len(inserts)} inserted, {failed} failed",
+        "summary": {"total": len(records), "inserted": len(inserts), "updated": len(updates), "errors": failed},
+        "results": outcomes,
+    })
+
 @app.route("/api/inventory/<int:inventory_id>", methods=["PUT"])
 @csrf.exempt
 @require_staff
@@ -1320,37 +2756,292 @@ def api_update_inventory(inventory_id):
     sell_price = float(data.get('sell_price', 0))
     image_url = (data.get('image_url') or '').strip()
     
+    expected_version = data.get('row_version')
+    
     if not hem_name:
         return jsonify({"success": False, "message": "Product name is required"}), 400
     
     try:
         with get_db() as conn:
-            conn.execute("""
+            sql = """
                 UPDATE inventory
-                SET sup_part_no=?, hem_name=?, category=?, qty=?, sell_price=?, image_url=?
+                SET sup_part_no=?, hem_name=?, category=?, qty=?, sell_price=?, image_url=?,
+                    row_version = row_version + 1
                 WHERE inventory_id=?
-            """, (sup_part_no, hem_name, category, qty, sell_price, image_url, inventory_id))
+            """
+            params = [sup_part_no, hem_name, category, qty, sell_price, image_url, inventory_id]
+            if expected_version is not None:
+                sql += " AND row_version=?"
+                params.append(expected_version)
+            record_qty_overwrites(conn, [(inventory_id, qty, expected_version)],
+                                  'adjustment', 'edit', session.get("username"))
+            updated = conn.execute(sql, params).rowcount
+            if not updated:
+                return inventory_conflict_response(conn, inventory_id)
             conn.commit()
             return jsonify({"success": True, "message": "Product updated successfully"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+def stock_qty(value):
+    """Cast a JSON qty: a non-negative whole number (3 or 3.0, not 3.9 or true)."""
+    if isinstance(value, bool):
+        raise ValueError("qty must be a number")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("qty must be a whole number")
+        value = int(value)
+    qty = int(value)
+    if not 0 <= qty <= SQLITE_INT_MAX:
+        raise ValueError("qty out of range")
+    return qty
+
+def shelf_price(value):
+    """Cast a JSON price: a finite, non-negative number."""
+    if isinstance(value, bool):
+        raise ValueError("price must be a number")
+    price = float(value)
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be finite and not negative")
+    return price
+
+INVENTORY_PATCH_FIELDS = {
+    "sup_part_no": str, "hem_name": str, "category": str, "org": str,
+    "loc_on_shelf": str, "qty": stock_qty, "sell_price": shelf_price, "image_url": str,
+}
+
+def inventory_conflict_response(conn, inventory_id):
+    """Build the 404/409 response for an inventory write that matched no row."""
+    current = conn.execute(
+        """SELECT inventory_id, sup_part_no, hem_name, category, org, loc_on_shelf,
+                  qty, sell_price, image_url, row_version
+           FROM inventory WHERE inventory_id = ?""",
+        (inventory_id,)
+    ).fetchone()
+    if not current:
+        return jsonify({"success": False, "message": "Product not found"}), 404
+    return jsonify({
+        "success": False,
+        "message": "Product was changed by someone else. Reload and try again.",
+        "current": dict(current)
+    }), 409
+
+@app.route("/api/inventory/<int:inventory_id>", methods=["PATCH"])
+@csrf.exempt
+@require_staff
+def api_patch_inventory(inventory_id):
+    """API: Update only the supplied fields of an inventory item, guarded by row_version."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    data = request.get_json(silent=True) or {}
+    
+    expected_version = data.get('row_version')
+    if not isinstance(expected_version, int) or isinstance(expected_version, bool):
+        return jsonify({"success": False, "message": "row_version is required"}), 400
+    
+    changes = {}
+    for field, cast in INVENTORY_PATCH_FIELDS.items():
+        if field not in data:
+            continue
+        try:
+            value = cast(data[field])
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": f"Invalid value for {field}"}), 400
+        if cast is str:
+            value = value.strip()
+        changes[field] = value
+    
+    if not changes:
+        return jsonify({"success": False, "message": "No fields to update"}), 400
+    if 'hem_name' in changes and not changes['hem_name']:
+        return jsonify({"success": False, "message": "Product name is required"}), 400
+    if changes.get('qty', 0) < 0 or changes.get('sell_price', 0) < 0:
+        return jsonify({"success": False, "message": "Stock and price cannot be negative"}), 400
+    
+    try:
+        with get_db() as conn:
+            if 'qty' in changes:
+                record_qty_overwrites(conn, [(inventory_id, changes['qty'], expected_version)],
+                                      'adjustment', 'edit', session.get("username"))
+            assignments = ", ".join(f"{field} = ?" for field in changes)
+            updated = conn.execute(
+                f"""UPDATE inventory
+                    SET {assignments}, row_version = row_version + 1
+                    WHERE inventory_id = ? AND row_version = ?""",
+                list(changes.values()) + [inventory_id, expected_version]
+            ).rowcount
+            if not updated:
+                return inventory_conflict_response(conn, inventory_id)
+            conn.commit()
+            return jsonify({
+                "success": True,
+                "message": "Product updated successfully",
+                "row_version": expected_version + 1
+            })
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route("/api/inventory/<int:inventory_id>", methods=["DELETE"])
 @csrf.exempt
 @require_staff
 def api_delete_inventory(inventory_id):
-    """API: Delete an inventory item permanently."""
+    """API: Delete an inventory item (archived instead if past orders reference it)."""
     # Admin should NOT have access to inventory
     if session.get("role") == "admin":
         return jsonify({"success": False, "message": "Access denied"}), 403
     try:
         with get_db() as conn:
-            conn.execute("DELETE FROM inventory WHERE inventory_id=?", (inventory_id,))
+            deleted, archived = delete_or_archive_inventory(conn, [inventory_id])
             conn.commit()
+            if archived:
+                return jsonify({"success": True, "message": "Product is referenced by past orders, so it was archived instead"})
             return jsonify({"success": True, "message": "Product deleted successfully"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+ARCHIVE_CHUNK_SIZE = 500  # rows per short write transaction
+
+def delete_or_archive_inventory(conn, ids):
+    """Hard-delete items no order references; archive the referenced ones. Returns (deleted, archived)."""
+    placeholders = ",".join("?" * len(ids))
+    deleted = conn.execute(f"""
+        DELETE FROM inventory
+        WHERE inventory_id IN ({placeholders})
+          AND NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.inventory_id = inventory.inventory_id)
+          AND NOT EXISTS (SELECT 1 FROM order_items_archive oia WHERE oia.inventory_id = inventory.inventory_id)
+    """, ids).rowcount
+    archived = conn.execute(f"""
+        UPDATE inventory SET archived = 1, row_version = row_version + 1
+        WHERE inventory_id IN ({placeholders}) AND archived = 0
+    """, ids).rowcount
+    return deleted, archived
+
+@app.route("/api/inventory/bulk-archive", methods=["POST"])
+@csrf.exempt
+@require_staff
+def api_bulk_archive_inventory():
+    """API: Archive, unarchive or delete many inventory items by id list or by org/category filter.
+
+    Body: {"action": "archive" | "unarchive" | "delete",
+           "ids": [...]} or {"filters": {"org": ..., "category": ...}}
+    Work is split into chunks with one short transaction each, so checkout
+    writes are never blocked for long. "delete" archives items that past
+    orders still reference instead of breaking order_items.
+    """
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    data = request.get_json(silent=True) or {}
+    action = data.get('action', 'archive')
+    ids = data.get('ids')
+    filters = data.get('filters') or {}
+    if action not in ('archive', 'unarchive', 'delete'):
+        return jsonify({"success": False, "message": "action must be archive, unarchive or delete"}), 400
+    if ids is None and not any(filters.get(f) for f in ('org', 'category')):
+        return jsonify({"success": False, "message": "Provide ids or at least one filter (org, category)"}), 400
+
+    try:
+        with get_db() as conn:
+            if ids is not None:
+                target_ids = parse_id_list(ids)
+                if target_ids is None:
+                    return jsonify({"success": False, "message": "ids must be a list of inventory ids"}), 400
+                target_ids.sort()
+            else:
+                where = ["archived = ?"]
+                params = [1 if action == 'unarchive' else 0]
+                for field in ('org', 'category'):
+                    if filters.get(field):
+                        where.append(f"{field} = ?")
+                        params.append(filters[field])
+                target_ids = [row[0] for row in conn.execute(
+                    f"SELECT inventory_id FROM inventory WHERE {' AND '.join(where)} ORDER BY inventory_id",
+                    params
+                )]
+
+            totals = {"matched": len(target_ids), "archived": 0, "unarchived": 0, "deleted": 0}
+            for chunk in chunked(target_ids, ARCHIVE_CHUNK_SIZE):
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute("BEGIN IMMEDIATE")
+                if action == 'delete':
+                    deleted, archived = delete_or_archive_inventory(conn, chunk)
+                    totals['deleted'] += deleted
+                    totals['archived'] += archived
+                else:
+                    flag = 1 if action == 'archive' else 0
+                    totals[f"{action}d"] += conn.execute(f"""
+                        UPDATE inventory SET archived = ?, row_version = row_version + 1
+                        WHERE inventory_id IN ({placeholders}) AND archived != ?
+                    """, [flag] + chunk + [flag]).rowcount
+                conn.commit()
+
+        return jsonify({
+            "success": True,
+            "message": f"{totals['matched']} item(s) matched: {totals['archived']} archived, "
+                       f"{totals['unarchived']} unarchived, {totals['deleted']} deleted",
+            "summary": totals
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/inventory/<int:inventory_id>/movements", methods=["GET"])
+@csrf.exempt
+@require_staff
+def api_inventory_movements(inventory_id):
+    """API: Recent ledger movements for an inventory item (newest first)."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"error": "Access denied"}), 403
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    before_id = request.args.get('before_id', type=int)
+    try:
+        with get_db() as conn:
+            where = "WHERE inventory_id = ?"
+            params = [inventory_id]
+            if before_id:
+                where += " AND movement_id < ?"
+                params.append(before_id)
+            rows = conn.execute(f"""
+                SELECT movement_id, movement_type, qty_change, reference, created_by, created_at
+                FROM inventory_movements
+                {where}
+                ORDER BY movement_id DESC
+                LIMIT ?
+            """, params + [limit]).fetchall()
+            return jsonify({
+                'movements': [dict(r) for r in rows],
+                'next_before_id': rows[-1]['movement_id'] if len(rows) == limit else None
+            })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/inventory/<int:inventory_id>/stock-at", methods=["GET"])
+@csrf.exempt
+@require_staff
+def api_inventory_stock_at(inventory_id):
+    """API: Point-in-time stock level for an inventory item (?as_of=YYYY-MM-DD[ HH:MM:SS], UTC)."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"error": "Access denied"}), 403
+    as_of = request.args.get('as_of', '').strip()
+    try:
+        parsed = datetime.fromisoformat(as_of)
+    except ValueError:
+        return jsonify({"error": "as_of must be an ISO date or datetime"}), 400
+    if len(as_of) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59)  # end of that day
+    as_of = parsed.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        with get_db() as conn:
+            return jsonify({
+                'inventory_id': inventory_id,
+                'as_of': as_of,
+                'qty': stock_at(conn, inventory_id, as_of)
+            })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/search_products", methods=["GET"])
 @csrf.exempt
 def api_search_products():
@@ -1369,11 +3060,12 @@ def api_search_products():
             # Search across ALL products in database
             cursor.execute("""
                 SELECT inventory_id, sup_part_no, hem_name, category, 
-                       org, loc_on_shelf, qty, sell_price, image_url
+                       org, loc_on_shelf, qty, sell_price, image_url, row_version
                 FROM inventory 
-                WHERE hem_name LIKE ? 
+                WHERE archived = 0
+                  AND (hem_name LIKE ? 
                    OR sup_part_no LIKE ? 
-                   OR category LIKE ?
+                   OR category LIKE ?)
                 ORDER BY inventory_id DESC
             """, (f'%{query}%', f'%{query}%', f'%{query}%'))
             
@@ -1409,7 +3101,7 @@ def api_get_product_variants():
                 SELECT inventory_id, sup_part_no, hem_name, category, 
                        org, loc_on_shelf, qty, sell_price, image_url
                 FROM inventory
-                WHERE hem_name = ? AND qty > 0
+                WHERE hem_name = ? AND qty > 0 AND archived = 0
                 ORDER BY sup_part_no ASC
             """, (product_name,)).fetchall()
             
@@ -1417,6 +3109,357 @@ def api_get_product_variants():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# === STOCK TAKE ROUTES ===
+
+def get_open_stock_take(conn, session_id):
+    """Return (session_row, error_response) for a stock-take session that must still be open."""
+    st = conn.execute(
+        "SELECT session_id, name, status FROM stock_take_sessions WHERE session_id = ?",
+        (session_id,)
+    ).fetchone()
+    if not st:
+        return None, (jsonify({"success": False, "message": "Stock-take session not found"}), 404)
+    if st['status'] != 'open':
+        return None, (jsonify({"success": False, "message": f"Session is already {st['status']}"}), 409)
+    return st, None
+
+@app.route("/api/stock-take/sessions", methods=["GET", "POST"])
+@csrf.exempt
+@require_staff
+def api_stock_take_sessions():
+    """API: List stock-take sessions (GET) or start a new one (POST {name})."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    try:
+        with get_db() as conn:
+            if request.method == "POST":
+                data = request.get_json(silent=True) or {}
+                name = (data.get('name') or '').strip() or f"Stock take {date.today().isoformat()}"
+                cursor = conn.execute(
+                    "INSERT INTO stock_take_sessions (name, created_by) VALUES (?, ?)",
+                    (name, session.get("username"))
+                )
+                conn.commit()
+                return jsonify({"success": True, "session_id": cursor.lastrowid, "name": name})
+
+            rows = conn.execute("""
+                SELECT s.session_id, s.name, s.status, s.created_by, s.created_at,
+                       s.reconciled_by, s.reconciled_at,
+                       COUNT(c.inventory_id) AS lines_counted,
+                       COALESCE(SUM(c.counted_qty != c.system_qty), 0) AS lines_with_variance
+                FROM stock_take_sessions s
+                LEFT JOIN stock_take_counts c ON c.session_id = s.session_id
+                GROUP BY s.session_id
+                ORDER BY s.session_id DESC
+                LIMIT 50
+            """).fetchall()
+            return jsonify({"sessions": [dict(r) for r in rows]})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/stock-take/sessions/<int:session_id>/counts", methods=["POST"])
+@csrf.exempt
+@require_staff
+def api_stock_take_capture(session_id):
+    """API: Capture a batch of counted lines for a stock-take session.
+
+    Body: {"lines": [{"sup_part_no"|"loc_on_shelf"|"inventory_id": ..., "qty": n}, ...],
+           "mode": "set" | "add"}
+    Lines for the same item within a batch are summed. "set" replaces an item's
+    earlier count in this session, "add" accumulates onto it. The system qty at
+    capture time is stored so sales made before reconciliation are not lost.
+    """
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    data = request.get_json(silent=True) or {}
+    lines = data.get('lines')
+    mode = data.get('mode', 'set')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({"success": False, "message": "lines must be a non-empty list"}), 400
+    if mode not in ('set', 'add'):
+        return jsonify({"success": False, "message": "mode must be 'set' or 'add'"}), 400
+
+    errors = []
+    batch = []
+    for line_no, line in enumerate(lines):
+        try:
+            qty = int(line.get('qty', line.get('counted_qty')))
+        except (AttributeError, TypeError, ValueError):
+            errors.append({"line": line_no, "message": "Invalid qty"})
+            continue
+        if qty < 0:
+            errors.append({"line": line_no, "message": "Counted qty cannot be negative"})
+            continue
+        inventory_id = line.get('inventory_id')
+        sup_part_no = (line.get('sup_part_no') or '').strip() or None
+        loc_on_shelf = (line.get('loc_on_shelf') or '').strip() or None
+        if inventory_id is None and not sup_part_no and not loc_on_shelf:
+            errors.append({"line": line_no, "message": "Line needs inventory_id, sup_part_no or loc_on_shelf"})
+            continue
+        batch.append((line_no, inventory_id, sup_part_no, loc_on_shelf, qty))
+
+    try:
+        with get_db() as conn:
+            st, error = get_open_stock_take(conn, session_id)
+            if error:
+                return error
+
+            conn.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS stock_take_batch (
+                    line_no INTEGER PRIMARY KEY,
+                    inventory_id INTEGER,
+                    sup_part_no TEXT,
+                    loc_on_shelf TEXT,
+                    qty INTEGER NOT NULL,
+                    matches INTEGER
+                )
+            """)
+            conn.execute("DELETE FROM temp.stock_take_batch")
+            conn.executemany(
+                "INSERT INTO temp.stock_take_batch (line_no, inventory_id, sup_part_no, loc_on_shelf, qty) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+
+            # Resolve every line to exactly one inventory row, set-based
+            conn.execute("""
+                UPDATE temp.stock_take_batch
+                SET matches = (SELECT COUNT(*) FROM inventory i WHERE i.inventory_id = stock_take_batch.inventory_id)
+                WHERE inventory_id IS NOT NULL
+            """)
+            for key in ("sup_part_no", "loc_on_shelf"):
+                conn.execute(f"""
+                    UPDATE temp.stock_take_batch
+                    SET matches = (SELECT COUNT(*) FROM inventory i WHERE i.{key} = stock_take_batch.{key}),
+                        inventory_id = (SELECT MIN(inventory_id) FROM inventory i WHERE i.{key} = stock_take_batch.{key})
+                    WHERE matches IS NULL AND {key} IS NOT NULL
+                """)
+            for row in conn.execute(
+                    "SELECT line_no, matches FROM temp.stock_take_batch WHERE matches != 1 ORDER BY line_no"):
+                errors.append({
+                    "line": row['line_no'],
+                    "message": "No matching item" if not row['matches']
+                               else f"Matches {row['matches']} items; use inventory_id or sup_part_no"
+                })
+
+            captured = conn.execute("""
+                INSERT INTO stock_take_counts (session_id, inventory_id, counted_qty, system_qty, counted_by)
+                SELECT ?, b.inventory_id, SUM(b.qty), i.qty, ?
+                FROM temp.stock_take_batch b
+                JOIN inventory i ON i.inventory_id = b.inventory_id
+                WHERE b.matches = 1
+                GROUP BY b.inventory_id
+                ON CONFLICT (session_id, inventory_id) DO UPDATE SET
+                    counted_qty = CASE WHEN ? = 'add' THEN counted_qty + excluded.counted_qty
+                                       ELSE excluded.counted_qty END,
+                    system_qty  = CASE WHEN ? = 'add' THEN system_qty ELSE excluded.system_qty END,
+                    counted_by  = excluded.counted_by,
+                    counted_at  = CURRENT_TIMESTAMP
+            """, (session_id, session.get("username"), mode, mode)).rowcount
+            conn.commit()
+
+        errors.sort(key=lambda e: e['line'])
+        return jsonify({
+            "success": True,
+            "message": f"{captured} item(s) counted, {len(errors)} line(s) rejected",
+            "items_counted": captured,
+            "errors": errors
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/stock-take/sessions/<int:session_id>/variances", methods=["GET"])
+@csrf.exempt
+@require_staff
+def api_stock_take_variances(session_id):
+    """API: Preview counted vs system quantities for a session (largest variances first)."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    limit = min(request.args.get('limit', 200, type=int), 5000)
+    only_variances = request.args.get('all', '0') not in ('1', 'true', 'yes')
+    try:
+        with get_db() as conn:
+            rows = conn.execute(f"""
+                SELECT c.inventory_id, i.sup_part_no, i.hem_name, i.loc_on_shelf,
+                       c.system_qty, c.counted_qty, c.counted_qty - c.system_qty AS variance,
+                       i.qty AS current_qty, c.counted_by, c.counted_at
+                FROM stock_take_counts c
+                JOIN inventory i ON i.inventory_id = c.inventory_id
+                WHERE c.session_id = ? {"AND c.counted_qty != c.system_qty" if only_variances else ""}
+                ORDER BY ABS(c.counted_qty - c.system_qty) DESC, i.loc_on_shelf
+                LIMIT ?
+            """, (session_id, limit)).fetchall()
+            totals = conn.execute("""
+                SELECT COUNT(*) AS lines_counted,
+                       COALESCE(SUM(counted_qty != system_qty), 0) AS lines_with_variance,
+                       COALESCE(SUM(counted_qty - system_qty), 0) AS net_variance
+                FROM stock_take_counts WHERE session_id = ?
+            """, (session_id,)).fetchone()
+            return jsonify({"variances": [dict(r) for r in rows], "totals": dict(totals)})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/stock-take/sessions/<int:session_id>/reconcile", methods=["POST"])
+@csrf.exempt
+@require_staff
+def api_stock_take_reconcile(session_id):
+    """API: Apply all variances of a session to inventory in one set-based transaction."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    username = session.get("username")
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            st, error = get_open_stock_take(conn, session_id)
+            if error:
+                conn.rollback()
+                return error
+
+            # Variance is measured against qty at count time, so later sales are preserved
+            conn.execute("""
+                INSERT INTO inventory_movements (inventory_id, movement_type, qty_change, reference, created_by)
+                SELECT inventory_id, 'stock_take', counted_qty - system_qty, ?, ?
+                FROM stock_take_counts
+                WHERE session_id = ? AND counted_qty != system_qty
+            """, (f"stocktake:{session_id}", username, session_id))
+            adjusted = conn.execute("""
+                UPDATE inventory
+                SET qty = inventory.qty + v.variance,
+                    row_version = inventory.row_version + 1
+                FROM (
+                    SELECT inventory_id, counted_qty - system_qty AS variance
+                    FROM stock_take_counts
+                    WHERE session_id = ? AND counted_qty != system_qty
+                ) AS v
+                WHERE v.inventory_id = inventory.inventory_id
+            """, (session_id,)).rowcount
+            conn.execute("""
+                UPDATE stock_take_sessions
+                SET status = 'reconciled', reconciled_by = ?, reconciled_at = CURRENT_TIMESTAMP
+                WHERE session_id = ?
+            """, (username, session_id))
+            conn.commit()
+
+        return jsonify({
+            "success": True,
+            "message": f"Stock take reconciled: {adjusted} item(s) adjusted",
+            "items_adjusted": adjusted
+        })
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# === LOW STOCK ALERT ROUTES ===
+
+def refresh_stock_alerts(conn, where_sql, params):
+    """Re-evaluate alerts for the inventory rows matching where_sql (used when thresholds change)."""
+    threshold = effective_threshold_sql('i')
+    conn.execute(f"""
+        INSERT OR IGNORE INTO stock_alerts (inventory_id, threshold, qty_at_alert)
+        SELECT inventory_id, threshold, qty
+        FROM (SELECT i.inventory_id, i.qty, {threshold} AS threshold
+              FROM inventory i WHERE i.archived = 0 AND {where_sql})
+        WHERE threshold IS NOT NULL AND qty <= threshold
+    """, params)
+    conn.execute(f"""
+        UPDATE stock_alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP
+        WHERE status = 'open' AND inventory_id IN (
+            SELECT i.inventory_id FROM inventory i
+            WHERE {where_sql} AND NOT COALESCE(i.archived = 0 AND i.qty <= {threshold}, 0)
+        )
+    """, params)
+
+@app.route("/api/reorder-thresholds", methods=["GET", "PUT"])
+@csrf.exempt
+@require_staff
+def api_reorder_thresholds():
+    """API: List thresholds (GET) or set one (PUT {scope, key, threshold}; threshold null removes it)."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    try:
+        with get_db() as conn:
+            if request.method == "GET":
+                rows = conn.execute("""
+                    SELECT scope, scope_key, threshold, updated_by, updated_at
+                    FROM reorder_thresholds ORDER BY scope, scope_key
+                """).fetchall()
+                return jsonify({"thresholds": [dict(r) for r in rows]})
+
+            data = request.get_json(silent=True) or {}
+            scope = data.get('scope')
+            key = str(data.get('key') or '').strip()
+            threshold = data.get('threshold')
+            if scope not in ('item', 'category', 'default'):
+                return jsonify({"success": False, "message": "scope must be item, category or default"}), 400
+            if scope == 'default':
+                key = ''
+            elif not key:
+                return jsonify({"success": False, "message": "key is required for item and category thresholds"}), 400
+            if threshold is not None:
+                try:
+                    threshold = int(threshold)
+                except (TypeError, ValueError):
+                    return jsonify({"success": False, "message": "threshold must be a whole number"}), 400
+                if threshold < 0:
+                    return jsonify({"success": False, "message": "threshold cannot be negative"}), 400
+
+            if threshold is None:
+                conn.execute("DELETE FROM reorder_thresholds WHERE scope = ? AND scope_key = ?", (scope, key))
+            else:
+                conn.execute("""
+                    INSERT INTO reorder_thresholds (scope, scope_key, threshold, updated_by)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (scope, scope_key) DO UPDATE SET
+                        threshold = excluded.threshold, updated_by = excluded.updated_by,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (scope, key, threshold, session.get("username")))
+
+            # Only the rows this threshold can affect are re-evaluated
+            if scope == 'item':
+                refresh_stock_alerts(conn, "i.inventory_id = ?", (key,))
+            elif scope == 'category':
+                refresh_stock_alerts(conn, "i.category = ?", (key,))
+            else:
+                refresh_stock_alerts(conn, "1 = 1", ())
+            conn.commit()
+            return jsonify({"success": True, "message": "Threshold saved"})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/stock-alerts", methods=["GET"])
+@csrf.exempt
+@require_staff
+def api_stock_alerts():
+    """API: List low-stock alerts (open by default, ?status=resolved for history)."""
+    # Admin should NOT have access to inventory
+    if session.get("role") == "admin":
+        return jsonify({"error": "Access denied"}), 403
+    status = request.args.get('status', 'open')
+    if status not in ('open', 'resolved'):
+        return jsonify({"error": "status must be open or resolved"}), 400
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    try:
+        with get_db() as conn:
+            rows = conn.execute("""
+                SELECT a.alert_id, a.inventory_id, i.sup_part_no, i.hem_name, i.category,
+                       i.loc_on_shelf, i.qty AS current_qty, a.threshold, a.qty_at_alert,
+                       a.status, a.opened_at, a.resolved_at
+                FROM stock_alerts a
+                LEFT JOIN inventory i ON i.inventory_id = a.inventory_id
+                WHERE a.status = ?
+                ORDER BY a.opened_at DESC, a.alert_id DESC
+                LIMIT ?
+            """, (status, limit)).fetchall()
+            open_count = conn.execute(
+                "SELECT COUNT(*) FROM stock_alerts WHERE status = 'open'"
+            ).fetchone()[0]
+            return jsonify({"alerts": [dict(r) for r in rows], "open_count": open_count})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # === SALES DASHBOARD ROUTES (ADMIN + SUPEROWNER ONLY) ===
 
 @app.route("/dashboard")
@@ -2119,14 +4162,27 @@ def serve_product_image(filename):
     images_dir = os.path.join(app.root_path, 'static', 'product_images_v2')
     return send_from_directory(images_dir, filename)
 
+# Image listing cached per directory mtime: {'mtime_ns': int, 'etag': str, 'files': list}
+_image_list_cache = {}
+
 @app.route('/api/image-list')
 def api_image_list():
     """Return list of all available product image filenames for frontend caching."""
     images_dir = os.path.join(app.root_path, 'static', 'product_images_v2')
     try:
-        files = [f for f in os.listdir(images_dir) 
-                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        return jsonify(files)
+        # Adding, removing or renaming a file bumps the directory mtime
+        mtime_ns = os.stat(images_dir).st_mtime_ns
+        if _image_list_cache.get('mtime_ns') != mtime_ns:
+            files = sorted(f for f in os.listdir(images_dir)
+                           if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+            manifest_hash = hashlib.sha1("\n".join(files).encode('utf-8')).hexdigest()[:16]
+            _image_list_cache.update(mtime_ns=mtime_ns, etag=f"images-{manifest_hash}", files=files)
+
+        etag = _image_list_cache['etag']
+        cached = not_modified_response(etag, IMAGE_LIST_CACHE_CONTROL)
+        if cached:
+            return cached
+        return with_validators(jsonify(_image_list_cache['files']), etag, IMAGE_LIST_CACHE_CONTROL)
     except Exception as e:
         return jsonify([])
 
@@ -3,7 +3,7 @@ import os
 import bcrypt
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
+DB_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
 
 conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
@@ -0,0 +1,180 @@
+"""
+Inventory Ledger - Append-only history of stock movements
+inventory.qty stays the maintained projection; every change to it is also written
+here in the same transaction. Old movements are periodically rolled into
+per-item snapshots so point-in-time queries only ever replay a short tail.
+
+Run as a script to compact the ledger:
+    python inventory_ledger.py --days 90
+"""
+import os
+import sqlite3
+import argparse
+from datetime import datetime, timedelta, timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
+
+MOVEMENT_TYPES = ('sale', 'cancellation', 'adjustment', 'import', 'stock_take')
+COMPACT_CHUNK_SIZE = 500  # inventory items per compaction transaction
+
+
+def init_ledger(conn):
+    """
+    Create ledger tables and give every untracked inventory item an opening
+    snapshot; items inserted later get theirs from a trigger.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_movements (
+            movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inventory_id INTEGER NOT NULL,
+            movement_type TEXT NOT NULL CHECK (movement_type IN
+                ('sale','cancellation','adjustment','import','stock_take')),
+            qty_change INTEGER NOT NULL,
+            reference TEXT,
+            created_by TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_snapshots (
+            snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inventory_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL,
+            snapshot_at DATETIME NOT NULL,
+            last_movement_id INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mov_item    ON inventory_movements(inventory_id, movement_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mov_created ON inventory_movements(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_snap_item   ON inventory_snapshots(inventory_id, snapshot_at)")
+
+    # Items loaded outside the app (e.g. uploading_in_db.py) start from their current qty
+    conn.execute("""
+        INSERT INTO inventory_snapshots (inventory_id, qty, snapshot_at, last_movement_id)
+        SELECT i.inventory_id, i.qty, CURRENT_TIMESTAMP,
+               (SELECT COALESCE(MAX(movement_id), 0) FROM inventory_movements)
+        FROM inventory i
+        WHERE NOT EXISTS (SELECT 1 FROM inventory_snapshots s WHERE s.inventory_id = i.inventory_id)
+          AND NOT EXISTS (SELECT 1 FROM inventory_movements m WHERE m.inventory_id = i.inventory_id)
+    """)
+    # Every new item (app, bulk upload or an outside import) starts from the qty it was inserted with
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_inventory_opening_snapshot AFTER INSERT ON inventory
+        BEGIN
+            INSERT INTO inventory_snapshots (inventory_id, qty, snapshot_at, last_movement_id)
+            VALUES (NEW.inventory_id, COALESCE(NEW.qty, 0), CURRENT_TIMESTAMP,
+                    (SELECT COALESCE(MAX(movement_id), 0) FROM inventory_movements));
+        END
+    """)
+
+
+def record_movements(conn, movements, created_by=None):
+    """
+    Append movements to the ledger in one executemany call.
+    movements: iterable of (inventory_id, movement_type, qty_change, reference)
+    Zero-quantity movements are skipped.
+    """
+    rows = [(inv_id, mtype, change, ref, created_by)
+            for inv_id, mtype, change, ref in movements if change]
+    if rows:
+        conn.executemany("""
+            INSERT INTO inventory_movements (inventory_id, movement_type, qty_change, reference, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+    return len(rows)
+
+
+def record_qty_overwrites(conn, overwrites, movement_type, reference=None, created_by=None):
+    """
+    Record the delta for qty overwrites BEFORE the UPDATE that applies them.
+    overwrites: iterable of (inventory_id, new_qty, expected_row_version or None)
+    The delta is computed in SQL against the row as it stands inside the
+    caller's write transaction, and nothing is recorded if the version check fails.
+    """
+    conn.executemany("""
+        INSERT INTO inventory_movements (inventory_id, movement_type, qty_change, reference, created_by)
+        SELECT inventory_id, ?, ? - qty, ?, ?
+        FROM inventory
+        WHERE inventory_id = ? AND qty != ?
+          AND (? IS NULL OR row_version = ?)
+    """, [(movement_type, new_qty, reference, created_by, inv_id, new_qty, version, version)
+          for inv_id, new_qty, version in overwrites if new_qty is not None])
+
+
+def stock_at(conn, inventory_id, as_of):
+    """Return the stock level of an item at a 'YYYY-MM-DD HH:MM:SS' timestamp (UTC)."""
+    snap = conn.execute("""
+        SELECT qty, last_movement_id FROM inventory_snapshots
+        WHERE inventory_id = ? AND snapshot_at <= ?
+        ORDER BY snapshot_at DESC, last_movement_id DESC
+        LIMIT 1
+    """, (inventory_id, as_of)).fetchone()
+    base_qty, after_id = (snap[0], snap[1]) if snap else (0, 0)
+
+    delta = conn.execute("""
+        SELECT COALESCE(SUM(qty_change), 0) FROM inventory_movements
+        WHERE inventory_id = ? AND movement_id > ? AND created_at <= ?
+    """, (inventory_id, after_id, as_of)).fetchone()[0]
+    return base_qty + delta
+
+
+def compact_movements(conn, before, chunk_size=COMPACT_CHUNK_SIZE):
+    """
+    Roll movements created at or before `before` into one snapshot per item.
+    Each chunk of items is compacted in its own short transaction, so the
+    projection stays consistent (snapshot + remaining movements == qty) throughout.
+    Returns (items_snapshotted, movements_removed).
+    """
+    high_water = conn.execute(
+        "SELECT MAX(movement_id) FROM inventory_movements WHERE created_at <= ?", (before,)
+    ).fetchone()[0]
+    if high_water is None:
+        return 0, 0
+
+    item_ids = [row[0] for row in conn.execute(
+        "SELECT DISTINCT inventory_id FROM inventory_movements WHERE movement_id <= ? ORDER BY inventory_id",
+        (high_water,)
+    )]
+
+    snapshotted = removed = 0
+    for start in range(0, len(item_ids), chunk_size):
+        chunk = item_ids[start:start + chunk_size]
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            snapshotted += conn.execute(f"""
+                INSERT INTO inventory_snapshots (inventory_id, qty, snapshot_at, last_movement_id)
+                SELECT m.inventory_id,
+                       COALESCE((SELECT s.qty FROM inventory_snapshots s
+                                 WHERE s.inventory_id = m.inventory_id
+                                 ORDER BY s.last_movement_id DESC, s.snapshot_at DESC LIMIT 1), 0)
+                         + SUM(m.qty_change),
+                       ?, ?
+                FROM inventory_movements m
+                WHERE m.movement_id <= ? AND m.inventory_id IN ({placeholders})
+                GROUP BY m.inventory_id
+            """, [before, high_water, high_water] + chunk).rowcount
+            removed += conn.execute(f"""
+                DELETE FROM inventory_movements
+                WHERE movement_id <= ? AND inventory_id IN ({placeholders})
+            """, [high_water] + chunk).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return snapshotted, removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact old inventory movements into snapshots")
+    parser.add_argument("--days", type=int, default=90, help="keep movements newer than this many days")
+    args = parser.parse_args()
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        items, movements = compact_movements(conn, cutoff)
+        print(f"✅ Compacted {movements} movements older than {cutoff} into {items} snapshots")
+    finally:
+        conn.close()
@@ -0,0 +1,138 @@
+"""
+Invoice Bridge - Turn completed web orders into sales invoices
+The dashboard and market analysis read sales_invoice_header / sales_invoice_line
+only, so every Completed web order is written there as one invoice:
+
+    invoice_no  WEB-<order id, 8 digits>  (deterministic, so re-runs are no-ops)
+    customer    the shared 'WEB' customer, legend 'WEB' (Web Store)
+    lines       one per order item, product_id looked up via products.sku_no
+
+The app bridges orders as they are completed; run as a script to backfill
+(live and archived orders):
+    python invoice_bridge.py
+"""
+import os
+import sqlite3
+import argparse
+
+from order_archive import ARCHIVE_TABLES, FINISHED_AT_SQL
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
+
+BRIDGE_CHUNK_SIZE = 500   # orders per invoice transaction
+DEFAULT_GST_RATE = 0.09   # shelf prices are GST-inclusive
+WEB_CUSTOMER_CODE = "WEB"
+WEB_LEGEND = ("WEB", "Web Store")
+
+INVOICE_NO_SQL = "('WEB-' || printf('%08d', {order_id}))"
+# Same SKU rule as inventory_sync.py, falling back to the SKU captured on the order line
+PRODUCT_SKU_SQL = "COALESCE(NULLIF(i.sup_part_no, ''), NULLIF(oi.product_sku, ''), 'INV-' || oi.inventory_id)"
+
+
+def web_invoice_no(order_id):
+    return f"WEB-{order_id:08d}"
+
+
+def get_web_customer_id(conn):
+    """customer_id of the shared web-store customer, created on first use."""
+    row = conn.execute(
+        "SELECT customer_id FROM customers WHERE customer_code = ? COLLATE NOCASE", (WEB_CUSTOMER_CODE,)
+    ).fetchone()
+    if row:
+        return row[0]
+    return conn.execute("INSERT INTO customers (customer_code) VALUES (?)", (WEB_CUSTOMER_CODE,)).lastrowid
+
+
+def bridge_orders(conn, order_ids, gst_rate=DEFAULT_GST_RATE,
+                  orders_table="transactions", items_table="order_items"):
+    """
+    Write invoices for the Completed orders among order_ids, a fixed number of
+    set-based statements per chunk. Orders already invoiced are skipped.
+    Call inside a write transaction. Returns the number of invoices created.
+    """
+    customer_id = get_web_customer_id(conn)
+    conn.execute("INSERT OR IGNORE INTO legends (legend_id, legend_name) VALUES (?, ?)", WEB_LEGEND)
+
+    created = 0
+    for start in range(0, len(order_ids), BRIDGE_CHUNK_SIZE):
+        chunk = list(order_ids[start:start + BRIDGE_CHUNK_SIZE])
+        placeholders = ",".join("?" * len(chunk))
+        # Items that never made it into the product master list
+        conn.execute(f"""
+            INSERT OR IGNORE INTO products (sku_no, hem_name)
+            SELECT DISTINCT {PRODUCT_SKU_SQL}, COALESCE(i.hem_name, oi.product_name)
+            FROM {items_table} oi
+            LEFT JOIN inventory i ON i.inventory_id = oi.inventory_id
+            WHERE oi.order_id IN ({placeholders})
+        """, chunk)
+        created += conn.execute(f"""
+            INSERT OR IGNORE INTO sales_invoice_header (invoice_no, invoice_date, customer_id, legend_id)
+            SELECT {INVOICE_NO_SQL.format(order_id="t.id")}, DATE({FINISHED_AT_SQL}), ?, ?
+            FROM {orders_table} t
+            WHERE t.id IN ({placeholders}) AND t.status = 'Completed'
+        """, [customer_id, WEB_LEGEND[0]] + chunk).rowcount
+        conn.execute(f"""
+            INSERT OR IGNORE INTO sales_invoice_line (invoice_no, line_no, product_id, qty, total_amt, gst_amt)
+            SELECT {INVOICE_NO_SQL.format(order_id="oi.order_id")},
+                   ROW_NUMBER() OVER (PARTITION BY oi.order_id ORDER BY oi.item_id),
+                   p.product_id,
+                   oi.quantity,
+                   ROUND(oi.quantity * oi.unit_price, 2),
+                   ROUND(oi.quantity * oi.unit_price * ? / (1 + ?), 2)
+            FROM {items_table} oi
+            JOIN {orders_table} t ON t.id = oi.order_id AND t.status = 'Completed'
+            LEFT JOIN inventory i ON i.inventory_id = oi.inventory_id
+            JOIN products p ON p.sku_no = {PRODUCT_SKU_SQL}
+            WHERE oi.order_id IN ({placeholders})
+        """, [gst_rate, gst_rate] + chunk)
+    return created
+
+
+def bridge_completed_orders(conn, gst_rate=DEFAULT_GST_RATE, chunk_size=BRIDGE_CHUNK_SIZE):
+    """
+    Backfill invoices for every Completed order not yet bridged, live and
+    archived, one short transaction per chunk. Returns invoices created.
+    """
+    sources = [("transactions", "order_items")]
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (ARCHIVE_TABLES["transactions"],)).fetchone():
+        sources.append((ARCHIVE_TABLES["transactions"], ARCHIVE_TABLES["order_items"]))
+
+    created = 0
+    for orders_table, items_table in sources:
+        last_id = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in conn.execute(f"""
+                    SELECT t.id FROM {orders_table} t
+                    WHERE t.id > ? AND t.status = 'Completed'
+                      AND NOT EXISTS (SELECT 1 FROM sales_invoice_header h
+                                      WHERE h.invoice_no = {INVOICE_NO_SQL.format(order_id="t.id")})
+                    ORDER BY t.id
+                    LIMIT ?
+                """, (last_id, chunk_size))]
+                if ids:
+                    created += bridge_orders(conn, ids, gst_rate, orders_table, items_table)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if len(ids) < chunk_size:
+                break
+            last_id = ids[-1]
+    return created
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create sales invoices for completed web orders")
+    parser.add_argument("--gst-rate", type=float, default=DEFAULT_GST_RATE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        created = bridge_completed_orders(conn, args.gst_rate)
+        print(f"✅ Created {created} invoices from completed web orders")
+    finally:
+        conn.close()
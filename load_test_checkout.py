@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Checkout Load Test - Concurrency harness for /process-payment
+Builds a throwaway database, serves the app from one or more processes and
+fires a configurable mix of concurrent checkouts and cancellations at it:
+
+    hot    - small carts on a few low-stock SKUs (contention on the same rows)
+    large  - big carts spread across the catalogue
+    cancel - /api/cancel-order on an order placed earlier in the run
+
+Reports throughput, latency percentiles, lock errors and any oversell or
+negative stock found in the database afterwards. Never touches database.db.
+
+Usage:
+    python load_test_checkout.py --requests 2000 --concurrency 32 --processes 2
+    python load_test_checkout.py --mix hot=60,large=30,cancel=10 --hot-stock 25
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import urllib.request
+import urllib.error
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('hot', 'large', 'cancel')
+
+
+def parse_mix(text):
+    """Parse 'hot=70,large=20,cancel=10' into scenario weights."""
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario '{name}' (use {', '.join(SCENARIOS)})")
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for '{name}'")
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one non-zero weight")
+    return weights
+
+
+def build_database(path, items, hot_skus, hot_stock, stock, seed):
+    """Create the schema with database.py and seed a generated catalogue. Returns {id: (price, qty)}."""
+    env = dict(os.environ, DATABASE_PATH=path)
+    subprocess.run([sys.executable, os.path.join(BASE_DIR, "database.py")],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+    rng = random.Random(seed)
+    rows = []
+    for i in range(items):
+        qty = hot_stock if i < hot_skus else stock
+        rows.append((f"LT-{i:06d}", f"LOAD TEST PART {i}", rng.choice(["Filters", "Lubricants", "Brakes"]),
+                     rng.choice(["JP", "DE", "TW"]), f"R{i % 40}-{i % 17}", qty, round(rng.uniform(2, 300), 2)))
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany("""
+            INSERT INTO inventory (sup_part_no, hem_name, category, org, loc_on_shelf, qty, sell_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        return {row[0]: (row[1], row[2]) for row in conn.execute(
+            "SELECT inventory_id, sell_price, qty FROM inventory ORDER BY inventory_id")}
+    finally:
+        conn.close()
+
+
+def serve(db_path, port):
+    """Server process: import the app against the generated database and serve it threaded."""
+    os.environ["DATABASE_PATH"] = db_path
+    sys.path.insert(0, BASE_DIR)
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request access log
+    import app as webapp
+    make_server("127.0.0.1", port, webapp.app, threaded=True).serve_forever()
+
+
+def staff_cookie(db_path):
+    """Signed session cookie for an employee, so the harness can call /api/cancel-order."""
+    os.environ["DATABASE_PATH"] = db_path
+    sys.path.insert(0, BASE_DIR)
+    import app as webapp
+    serializer = webapp.app.session_interface.get_signing_serializer(webapp.app)
+    return "session=" + serializer.dumps({"role": "employee", "username": "loadtest"})
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/cart", timeout=2).close()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def call(method, url, payload=None, cookie=None, timeout=60):
+    """Send one request; returns (status, parsed JSON body or {})."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    if cookie:
+        req.add_header("Cookie", cookie)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b"{}")
+        except ValueError:
+            return e.code, {}
+
+
+class LoadTest:
+    def __init__(self, args, catalogue, ports, cookie):
+        self.args = args
+        self.catalogue = catalogue
+        self.ids = sorted(catalogue)
+        self.hot_ids = self.ids[:args.hot_skus]
+        self.ports = ports
+        self.cookie = cookie
+        self.mix = [(name, weight) for name, weight in args.mix.items() if weight > 0]
+        self.placed = []   # order ids available for cancellation
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def cart(self, ids, max_qty):
+        return [{"id": inv_id, "quantity": random.randint(1, max_qty), "price": self.catalogue[inv_id][0]}
+                for inv_id in ids]
+
+    def one_request(self, n):
+        port = self.ports[n % len(self.ports)]
+        base = f"http://127.0.0.1:{port}"
+        scenario = random.choices([m[0] for m in self.mix], weights=[m[1] for m in self.mix])[0]
+
+        order_id = None
+        if scenario == "cancel":
+            with self.lock:
+                if self.placed:
+                    order_id = self.placed.pop(random.randrange(len(self.placed)))
+            if order_id is None:
+                scenario = "hot"
+
+        if scenario == "cancel":
+            method, url, payload, cookie = "DELETE", f"{base}/api/cancel-order/{order_id}", None, self.cookie
+        else:
+            if scenario == "hot":
+                lines = self.cart([random.choice(self.hot_ids)], 2)
+            else:
+                size = min(self.args.large_cart_size, len(self.ids))
+                lines = self.cart(random.sample(self.ids, size), 3)
+            method, url, cookie = "POST", f"{base}/process-payment", None
+            payload = {"cart": lines, "payment_method": "Credit Card", "fulfillment_method": "pickup",
+                       "customer_phone": "90000000"}
+
+        started = time.perf_counter()
+        try:
+            status, body = call(method, url, payload, cookie)
+        except Exception as e:
+            status, body = 0, {"message": str(e)}
+        elapsed = time.perf_counter() - started
+
+        message = str(body.get("message", ""))
+        if body.get("success"):
+            outcome = "ok"
+        elif "locked" in message.lower() or "busy" in message.lower():
+            outcome = "lock_error"
+        elif "insufficient stock" in message.lower():
+            outcome = "out_of_stock"
+        elif status == 0:
+            outcome = "connection_error"
+        else:
+            outcome = f"http_{status}"
+
+        with self.lock:
+            self.latencies[scenario].append(elapsed)
+            self.outcomes[scenario][outcome] += 1
+            if scenario != "cancel" and body.get("success") and body.get("order_id"):
+                self.placed.append(body["order_id"])
+
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(self.one_request, range(self.args.requests)))
+        return time.perf_counter() - started
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def check_stock(db_path, catalogue):
+    """Compare final stock with what the non-cancelled orders account for. Returns a list of problems."""
+    conn = sqlite3.connect(db_path)
+    try:
+        sold = dict(conn.execute("""
+            SELECT oi.inventory_id, SUM(oi.quantity) FROM order_items oi
+            JOIN transactions t ON t.id = oi.order_id
+            WHERE t.status != 'Cancelled'
+            GROUP BY oi.inventory_id
+        """).fetchall())
+        problems = []
+        for inv_id, qty in conn.execute("SELECT inventory_id, qty FROM inventory"):
+            initial = catalogue[inv_id][1]
+            if qty < 0:
+                problems.append(f"item {inv_id}: negative stock {qty}")
+            expected = initial - sold.get(inv_id, 0)
+            if qty != expected:
+                problems.append(f"item {inv_id}: qty {qty} but orders account for {expected}")
+            if sold.get(inv_id, 0) > initial:
+                problems.append(f"item {inv_id}: oversold {sold[inv_id]} of {initial}")
+        return problems
+    finally:
+        conn.close()
+
+
+def report(test, elapsed, problems):
+    total = sum(len(v) for v in test.latencies.values())
+    print(f"\n📊 {total} requests in {elapsed:.2f}s  ->  {total / elapsed:.1f} req/s "
+          f"({test.args.concurrency} clients, {len(test.ports)} server process(es))")
+    print(f"{'scenario':<8} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  outcomes")
+    for scenario in SCENARIOS:
+        values = sorted(test.latencies.get(scenario, []))
+        if not values:
+            continue
+        outcomes = ", ".join(f"{k}={v}" for k, v in sorted(test.outcomes[scenario].items()))
+        print(f"{scenario:<8} {len(values):>6} {percentile(values, 50) * 1000:>8.1f} "
+              f"{percentile(values, 95) * 1000:>8.1f} {percentile(values, 99) * 1000:>8.1f} "
+              f"{values[-1] * 1000:>8.1f}  {outcomes}")
+
+    lock_errors = sum(o.get("lock_error", 0) for o in test.outcomes.values())
+    print(f"\n🔒 Lock errors: {lock_errors}")
+    if problems:
+        print(f"❌ Stock check failed ({len(problems)} problems):")
+        for problem in problems[:20]:
+            print(f"   {problem}")
+    else:
+        print("✅ Stock check passed: no negative stock, no oversell, qty matches orders")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the checkout path")
+    parser.add_argument("--requests", type=int, default=1000, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--processes", type=int, default=1, help="server processes sharing the database")
+    parser.add_argument("--port", type=int, default=5055, help="first server port")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("hot=70,large=20,cancel=10"),
+                        help="scenario weights, e.g. hot=70,large=20,cancel=10")
+    parser.add_argument("--items", type=int, default=2000, help="inventory rows to generate")
+    parser.add_argument("--hot-skus", type=int, default=5, help="number of contended SKUs")
+    parser.add_argument("--hot-stock", type=int, default=50, help="starting qty of each hot SKU")
+    parser.add_argument("--stock", type=int, default=500, help="starting qty of other SKUs")
+    parser.add_argument("--large-cart-size", type=int, default=25, help="lines per large cart")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep-db", action="store_true", help="keep the generated database for inspection")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="checkout_load_")
+    db_path = os.path.join(workdir, "database.db")
+    print(f"🛠️  Generating {args.items} items in {db_path}")
+    catalogue = build_database(db_path, args.items, args.hot_skus, args.hot_stock, args.stock, args.seed)
+    random.seed(args.seed)
+
+    ctx = multiprocessing.get_context("spawn")
+    ports = [args.port + i for i in range(args.processes)]
+    servers = [ctx.Process(target=serve, args=(db_path, port), daemon=True) for port in ports]
+    try:
+        for server in servers:
+            server.start()
+        for port in ports:
+            wait_until_up(port)
+
+        test = LoadTest(args, catalogue, ports, staff_cookie(db_path))
+        print(f"🚀 Sending {args.requests} requests ({', '.join(f'{k}={v:g}' for k, v in args.mix.items())})")
+        elapsed = test.run()
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+
+    problems = check_stock(db_path, catalogue)
+    report(test, elapsed, problems)
+    if args.keep_db:
+        print(f"\n💾 Database kept at {db_path}")
+    else:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
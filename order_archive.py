@@ -0,0 +1,120 @@
+"""
+Order Archive - Move old finished orders out of the hot tables
+Orders completed or cancelled more than N days ago are copied with their items into
+transactions_archive / order_items_archive and removed from the live tables,
+in short chunked transactions, so the orders board only ever scans recent work.
+Archived orders stay readable through the archive tables (orders board
+Completed and Cancelled tabs with ?archived=1).
+
+Run as a script to archive:
+    python order_archive.py --days 180
+"""
+import os
+import sqlite3
+import argparse
+from datetime import datetime, timedelta, timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
+
+ARCHIVE_CHUNK_SIZE = 500  # orders per archive transaction
+
+# live table -> archive table
+ARCHIVE_TABLES = {
+    "transactions": "transactions_archive",
+    "order_items": "order_items_archive",
+}
+
+FINISHED_STATUSES = ("Completed", "Cancelled")
+
+# When an order was finished: its cancellation, else its last recorded move to
+# Completed, else when it was placed
+FINISHED_AT_SQL = """
+    COALESCE(t.cancelled_at,
+             (SELECT MAX(ost.changed_at) FROM order_status_transitions ost
+              WHERE ost.order_id = t.id AND ost.to_status = 'Completed'),
+             t.timestamp)
+"""
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def init_order_archive(conn):
+    """Create the archive tables and keep their columns in step with the live tables."""
+    for live, archive in ARCHIVE_TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {archive} AS SELECT * FROM {live} WHERE 0")
+        archived = set(table_columns(conn, archive))
+        # Columns added to the live table by later migrations
+        for row in conn.execute(f"PRAGMA table_info({live})").fetchall():
+            if row[1] not in archived:
+                conn.execute(f"ALTER TABLE {archive} ADD COLUMN {row[1]} {row[2]}")
+        if "archived_at" not in archived:
+            conn.execute(f"ALTER TABLE {archive} ADD COLUMN archived_at DATETIME")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_txa_id       ON transactions_archive(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txa_status_ts       ON transactions_archive(status, timestamp, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txa_username        ON transactions_archive(username COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txa_payment         ON transactions_archive(payment_type COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txa_phone           ON transactions_archive(customer_phone COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_oia_order           ON order_items_archive(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_oia_item            ON order_items_archive(inventory_id)")
+
+
+def archive_finished_orders(conn, before, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Archive orders completed or cancelled at or before `before` ('YYYY-MM-DD HH:MM:SS').
+    Each chunk is copied and deleted in its own short write transaction, so
+    the storefront and board are never blocked for long.
+    Returns (orders_archived, items_archived).
+    """
+    tx_columns = ", ".join(table_columns(conn, "transactions"))
+    item_columns = ", ".join(table_columns(conn, "order_items"))
+
+    orders = items = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [row[0] for row in conn.execute(f"""
+                SELECT t.id FROM transactions t
+                WHERE t.status IN ({",".join("?" * len(FINISHED_STATUSES))}) AND {FINISHED_AT_SQL} <= ?
+                ORDER BY t.id
+                LIMIT ?
+            """, (*FINISHED_STATUSES, before, chunk_size))]
+            if not ids:
+                conn.rollback()
+                break
+            placeholders = ",".join("?" * len(ids))
+            conn.execute(f"""
+                INSERT INTO transactions_archive ({tx_columns}, archived_at)
+                SELECT {tx_columns}, CURRENT_TIMESTAMP FROM transactions WHERE id IN ({placeholders})
+            """, ids)
+            items += conn.execute(f"""
+                INSERT INTO order_items_archive ({item_columns}, archived_at)
+                SELECT {item_columns}, CURRENT_TIMESTAMP FROM order_items WHERE order_id IN ({placeholders})
+            """, ids).rowcount
+            conn.execute(f"DELETE FROM order_items WHERE order_id IN ({placeholders})", ids)
+            orders += conn.execute(f"DELETE FROM transactions WHERE id IN ({placeholders})", ids).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if len(ids) < chunk_size:
+            break
+    return orders, items
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old completed and cancelled orders")
+    parser.add_argument("--days", type=int, default=180, help="archive orders finished more than this many days ago")
+    args = parser.parse_args()
+
+    # Stored timestamps are SQLite CURRENT_TIMESTAMP values, i.e. UTC
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        init_order_archive(conn)
+        orders, items = archive_finished_orders(conn, cutoff)
+        print(f"✅ Archived {orders} orders ({items} items) finished before {cutoff}")
+    finally:
+        conn.close()